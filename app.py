@@ -1,14 +1,28 @@
 from flask import Flask
 from dotenv import load_dotenv
+import logging
+import multiprocessing
 import os
+import threading
+
+# models.py and friends read their configuration at import time, so .env has to be loaded first.
+load_dotenv()
+
 from extensions import bcrypt, login_manager
-from models import User
+from models import User, warm_caches
+from ingest import INGEST_MODE, get_pipeline
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
+import metrics
+
+CACHE_WARMUP = os.getenv('CACHE_WARMUP', 'true').lower() == 'true'
+# Number of reverse proxies in front of the app whose X-Forwarded-For entries are trusted (Vercel adds one).
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1' if os.getenv('VERCEL') else '0'))
+
+logger = logging.getLogger(__name__)
 
 def create_app():
     """Application Factory Function"""
-    load_dotenv()
-
     app = Flask(
         __name__,
         static_folder='static',
@@ -17,6 +31,7 @@ def create_app():
 
 
     app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
+    if TRUSTED_PROXY_HOPS: app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 
     csrf = CSRFProtect(app)
 
@@ -35,4 +50,24 @@ def create_app():
     from routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
-    return app
\ No newline at end of file
+    metrics.init_app(app)
+
+    # Password-hashing workers and their fork server (passwords.py) re-import the main module, and
+    # with it this factory, while multiprocessing marks them as inheriting from their parent.
+    # Only the serving process runs the background threads.
+    if getattr(multiprocessing.current_process(), '_inheriting', False) or multiprocessing.parent_process() is not None: return app
+
+    if not TRUSTED_PROXY_HOPS:
+        logger.warning("TRUSTED_PROXY_HOPS is 0, so client IPs are taken from the connection. If the app runs behind a reverse proxy, every client shares the proxy's address: logins are throttled together (LOGIN_MAX_PER_IP) and pings record the proxy's IP. Set TRUSTED_PROXY_HOPS to the number of proxies in front of the app.")
+
+    if INGEST_MODE == 'async':
+        # Replays pings journaled by a previous process now, not when the next device reports in.
+        get_pipeline().start()
+
+    if CACHE_WARMUP:
+        # Runs alongside the first requests rather than ahead of them; a cold start never waits on it.
+        warmup = threading.Thread(target=warm_caches, name='cache-warmup', daemon=True)
+        warmup.start()
+        app.extensions['cache_warmup'] = warmup
+
+    return app
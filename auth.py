@@ -1,21 +1,47 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_user, logout_user, login_required
-from models import User, create_user, is_signup_enabled 
-from extensions import bcrypt
+from models import User, create_user, is_signup_enabled
+from passwords import hasher, PasswordHasherBusy
+from throttle import ip_limiter, username_limiter, client_ip
 
 auth = Blueprint('auth', __name__)
 
+def _throttled(template, retry_after):
+    flash(f'Too many attempts. Please try again in {max(1, round(retry_after / 60))} minute(s).', 'danger')
+    return render_template(template), 429
+
+def _busy(template):
+    flash('The server is busy. Please try again in a moment.', 'warning')
+    return render_template(template), 503
+
+def _check_password(user, username, password):
+    """Checks `password` against the cached user, re-reading the user from Notion once
+    on a mismatch in case the hash was changed there since it was cached."""
+    if hasher.check(user.password_hash, password): return user
+    fresh = User.get_by_username(username, use_cache=False)
+    if fresh and fresh.password_hash != user.password_hash and hasher.check(fresh.password_hash, password): return fresh
+    return None
+
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        user = User.get_by_username(username)
-        if user and bcrypt.check_password_hash(user.password_hash, password):
+        # Throttle before touching Notion or bcrypt, so brute force costs us nothing.
+        retry_after = ip_limiter.hit(client_ip()) or username_limiter.retry_after(username)
+        if retry_after: return _throttled('login.html', retry_after)
+        user = User.get_by_username(username) if username and password else None
+        try:
+            user = user and _check_password(user, username, password)
+        except PasswordHasherBusy:
+            return _busy('login.html')
+        if user:
+            username_limiter.reset(username)
             login_user(user, remember=True)
             if user.role == 'Admin': return redirect(url_for('main.admin_dashboard'))
             else: return redirect(url_for('main.user_dashboard'))
         else:
+            if username: username_limiter.hit(username)
             flash('Login Unsuccessful. Please check username and password.', 'danger')
             return redirect(url_for('auth.login'))
     return render_template('login.html')
@@ -29,11 +55,19 @@ def signup():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        retry_after = ip_limiter.hit(client_ip())
+        if retry_after: return _throttled('signup.html', retry_after)
+        if not username or not password:
+            flash('Username and password are required.', 'danger')
+            return redirect(url_for('auth.signup'))
         existing_user = User.get_by_username(username)
         if existing_user:
             flash('Username already exists. Please choose a different one.', 'danger')
             return redirect(url_for('auth.signup'))
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        try:
+            hashed_password = hasher.hash(password)
+        except PasswordHasherBusy:
+            return _busy('signup.html')
         new_user = create_user(username, hashed_password)
         if new_user:
             flash('Account created successfully! You can now log in.', 'success')
@@ -47,4 +81,4 @@ def signup():
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('auth.login'))
\ No newline at end of file
+    return redirect(url_for('auth.login'))
@@ -0,0 +1,228 @@
+"""Load test for the whole request path, run against fake_notion.py.
+
+Seeds a fake Notion workspace with users, geofences and location history,
+then drives the app through Flask test clients from several threads and
+reports throughput, p50/p99 latency and Notion calls per request.
+
+    python benchmark.py --users 50 --pings 200 --requests 200 --latency 0.2
+
+With --startup it instead measures cold starts: each run is a fresh
+interpreter that imports the app, builds it and serves its first requests.
+
+    python benchmark.py --startup --runs 10
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from fake_notion import FakeNotion
+
+SCENARIOS = ('login', 'send_location', 'latest_locations', 'export')
+PASSWORD = 'benchmark'
+
+
+def _title(value): return {'title': [{'text': {'content': value}}]}
+def _text(value): return {'rich_text': [{'text': {'content': value}}]}
+
+
+def seed(fake, users, pings, geofences, bcrypt_rounds):
+    """Fills the fake databases and returns [(page_id, username), ...] for the regular users."""
+    from flask_bcrypt import Bcrypt
+    password_hash = Bcrypt().generate_password_hash(PASSWORD, rounds=bcrypt_rounds).decode('utf-8')
+    fake.add_page('settings', {'Setting': _title('SignUpEnabled'), 'Value': _text('true')})
+    fake.add_page('users', {'UserID': _title('bench-admin'), 'Username': _text('admin'), 'Role': {'select': {'name': 'Admin'}}, 'PasswordHash': _text(password_hash)})
+    for index in range(geofences):
+        fake.add_page('geofences', {'Name': _title(f'zone-{index}'), 'Latitude': {'number': 40 + random.uniform(-1, 1)}, 'Longitude': {'number': -74 + random.uniform(-1, 1)}, 'Radius': {'number': random.uniform(100, 2000)}})
+    accounts = []
+    start = datetime.now(timezone.utc) - timedelta(days=7)
+    for index in range(users):
+        page = fake.add_page('users', {'UserID': _title(f'bench-{index}'), 'Username': _text(f'user{index}'), 'Role': {'select': {'name': 'User'}}, 'PasswordHash': _text(password_hash)})
+        accounts.append((page['id'], f'user{index}'))
+        lat, lon = 40 + random.uniform(-1, 1), -74 + random.uniform(-1, 1)
+        for step in range(pings):
+            lat += random.uniform(-0.001, 0.001); lon += random.uniform(-0.001, 0.001)
+            timestamp = (start + timedelta(minutes=step)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            fake.add_page('locations', {'LogID': _title(f'bench-{index}-{step}'), 'User': {'relation': [{'id': page['id']}]}, 'Timestamp': {'date': {'start': timestamp}}, 'Latitude': {'number': lat}, 'Longitude': {'number': lon}, 'IPAddress': _text('127.0.0.1'), 'Battery': _text('Charging: No, Level: 80%'), 'DeviceInfo': _text('benchmark')})
+    return accounts
+
+
+def percentile(values, fraction):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(name, fake, requests, concurrency, make_worker, settle=None):
+    """Runs `requests` calls spread over `concurrency` threads, each using its own worker
+    from `make_worker(thread_index)`, and returns the scenario's summary row."""
+    workers = [make_worker(index) for index in range(concurrency)]
+    latencies = []; errors = [0]; lock = threading.Lock()
+    fake.reset_calls()
+
+    def drive(index):
+        worker = workers[index % concurrency]
+        began = time.perf_counter()
+        ok = worker()
+        elapsed = time.perf_counter() - began
+        with lock:
+            latencies.append(elapsed)
+            if not ok: errors[0] += 1
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(drive, range(requests)))
+    elapsed = time.perf_counter() - began
+    if settle: settle()
+    return {'scenario': name, 'requests': requests, 'errors': errors[0], 'seconds': round(elapsed, 3), 'throughput': round(requests / elapsed, 2) if elapsed else 0.0, 'p50_ms': round(percentile(latencies, 0.5) * 1000, 1), 'p99_ms': round(percentile(latencies, 0.99) * 1000, 1), 'notion_calls_per_request': round(fake.total_calls() / requests, 2), 'notion_calls': dict(fake.calls)}
+
+
+# Runs in a fresh interpreter per cold start; prints its timings (ms) as one JSON object.
+STARTUP_PROBE = """
+import json, time
+began = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app(); application.config['WTF_CSRF_ENABLED'] = False
+created = time.perf_counter()
+client = application.test_client()
+ok = client.get('/login').status_code == 200
+first = time.perf_counter()
+ok = client.post('/login', data={'username': %r, 'password': %r}).status_code == 302 and ok
+ok = client.get('/user/dashboard').status_code == 200 and ok
+dashboard = time.perf_counter()
+ms = lambda seconds: round(seconds * 1000, 1)
+print(json.dumps({'import_ms': ms(imported - began), 'create_app_ms': ms(created - imported), 'first_response_ms': ms(first - began), 'first_dashboard_ms': ms(dashboard - began), 'ok': ok}))
+"""
+STARTUP_METRICS = ('process_ms', 'import_ms', 'create_app_ms', 'first_response_ms', 'first_dashboard_ms')
+
+
+def startup(runs, username):
+    """Times `runs` cold starts, each in a new interpreter, and returns their median/min/max."""
+    samples = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE % (username, PASSWORD)], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['process_ms'] = round((time.perf_counter() - began) * 1000, 1)
+        samples.append(sample)
+    return [{'metric': name, 'median': percentile([sample[name] for sample in samples], 0.5), 'min': min(sample[name] for sample in samples), 'max': max(sample[name] for sample in samples)} for name in STARTUP_METRICS] + [{'metric': 'errors', 'count': sum(not sample['ok'] for sample in samples)}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--pings', type=int, default=100, help='seeded location rows per user')
+    parser.add_argument('--geofences', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake Notion latency per call, seconds')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rate-limit', type=float, default=None, help='fake Notion answers 429 above this many requests per second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 429 from fake Notion')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these scenarios (repeatable)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--startup', action='store_true', help='measure cold starts instead of running the scenarios')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to time with --startup')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    fake = FakeNotion(args.latency, args.jitter, args.page_size, args.rate_limit, args.error_rate)
+    accounts = seed(fake, args.users, args.pings, args.geofences, args.bcrypt_rounds)
+    workdir = tempfile.mkdtemp(prefix='locsent-bench-')
+    # models.py reads its configuration at import time, so this must happen before importing the app.
+    os.environ.update(NOTION_API_URL=fake.start(), NOTION_API_KEY='benchmark', FLASK_SECRET_KEY='benchmark', NOTION_DATABASE_ID_USERS='users', NOTION_DATABASE_ID_LOCATIONS='locations', NOTION_DATABASE_ID_GEOFENCES='geofences', NOTION_DATABASE_ID_SETTINGS='settings')
+    os.environ.setdefault('INGEST_SPOOL_DIR', os.path.join(workdir, 'spool'))
+    os.environ.setdefault('LOCATION_DB_PATH', os.path.join(workdir, 'locations.db'))
+    # Every simulated client shares one IP, which would otherwise trip the login throttle.
+    os.environ.setdefault('LOGIN_MAX_PER_IP', str(10 ** 9))
+
+    if args.startup:
+        results = startup(args.runs, accounts[0][1] if accounts else 'admin')
+        fake.stop()
+        if args.json:
+            json.dump(results, sys.stdout, indent=2); print()
+            return
+        print(f"{args.runs} cold starts, {args.users} users, Notion latency {args.latency}s (+{args.jitter}s jitter), cache warmup {os.getenv('CACHE_WARMUP', 'true')}")
+        print(f"{'metric':<22}{'median':>10}{'min':>10}{'max':>10}")
+        for row in results[:-1]:
+            print(f"{row['metric']:<22}{row['median']:>10}{row['min']:>10}{row['max']:>10}")
+        print(f"{'errors':<22}{results[-1]['count']:>10}")
+        return
+
+    from app import create_app
+    import ingest
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    # Let the startup warmup finish so its Notion calls aren't counted against the first scenario.
+    if 'cache_warmup' in app.extensions: app.extensions['cache_warmup'].join()
+
+    def client_for(username):
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': PASSWORD})
+        return client
+
+    def login_worker(index):
+        def call():
+            _, username = random.choice(accounts)
+            return app.test_client().post('/login', data={'username': username, 'password': PASSWORD}).status_code == 302
+        return call
+
+    def send_location_worker(index):
+        client = client_for(accounts[index % len(accounts)][1])
+        def call():
+            ping = {'latitude': 40 + random.uniform(-1, 1), 'longitude': -74 + random.uniform(-1, 1), 'battery': 'Charging: No, Level: 50%', 'deviceInfo': 'benchmark'}
+            return client.post('/user/send_location', json=ping).status_code in (200, 202)
+        return call
+
+    def latest_locations_worker(index):
+        client = client_for('admin')
+        def call():
+            response = client.get('/admin/api/get_all_latest_locations')
+            response.get_data()
+            return response.status_code == 200
+        return call
+
+    def export_worker(index):
+        client = client_for('admin')
+        def call():
+            page_id, username = random.choice(accounts)
+            response = client.get(f'/admin/export_logs/{page_id}/{username}/csv')
+            response.get_data()
+            return response.status_code == 200
+        return call
+
+    def drain_ingest():
+        """Waits for queued pings to reach Notion so their writes are counted against the scenario."""
+        if ingest.INGEST_MODE != 'async': return
+        pipeline = ingest.get_pipeline()
+        while True:
+            stats = pipeline.stats()
+            if not stats['depth'] and not stats['in_flight']: return
+            time.sleep(0.05)
+
+    scenarios = {'login': (login_worker, None), 'send_location': (send_location_worker, drain_ingest), 'latest_locations': (latest_locations_worker, None), 'export': (export_worker, None)}
+    results = [run(name, fake, args.requests, args.concurrency, *scenarios[name]) for name in (args.scenario or SCENARIOS)]
+    fake.stop()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2); print()
+        return
+    print(f"{args.users} users x {args.pings} pings, {args.requests} requests/scenario, concurrency {args.concurrency}, Notion latency {args.latency}s (+{args.jitter}s jitter)")
+    print(f"{'scenario':<18}{'reqs':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'notion/req':>12}")
+    for row in results:
+        print(f"{row['scenario']:<18}{row['requests']:>6}{row['errors']:>8}{row['throughput']:>9}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['notion_calls_per_request']:>12}")
+
+
+if __name__ == '__main__':
+    main()
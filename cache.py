@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drops every entry whose value satisfies `predicate`."""
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class VersionedCache:
+    """Shared cache of values loaded on demand (settings, user lists, ...).
+
+    Concurrent misses on a key share a single load. Every key carries a
+    version that `set` and `invalidate` bump, so a load that started before
+    a write cannot store its now-stale result afterwards. Loaders return None
+    to signal a failure, which is passed through but never cached.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._data = {}
+        self._versions = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] > time.monotonic(): return entry
+        return None
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                entry = self._fresh(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+                version = self._versions.get(key, 0)
+            value = loader()
+            with self._lock:
+                if value is not None and self._versions.get(key, 0) == version:
+                    self._data[key] = (value, time.monotonic() + self.ttl)
+            return value
+
+    def set(self, key, value):
+        """Write-through: replaces the cached value after a successful write to the backend."""
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._data[key] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._data.pop(key, None)
+
+    def version(self, key):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0}
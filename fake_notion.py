@@ -0,0 +1,193 @@
+"""Offline stand-in for the parts of the Notion API this app uses.
+
+Implements `POST /v1/databases/<id>/query` (the filter, sort and pagination
+subset models.py relies on, including created_time/last_edited_time filters), `POST /v1/pages` and `PATCH /v1/pages/<id>`,
+with configurable latency, page size and injected 429s. Point the app at it
+with NOTION_API_URL=http://127.0.0.1:<port>/v1.
+
+    python fake_notion.py --port 8765 --latency 0.25 --rate-limit 3
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import Flask, jsonify, request
+
+
+def _plain(prop):
+    """Comparable value of a stored property (write-format JSON, as the app sends it)."""
+    if not prop: return None
+    if 'title' in prop or 'rich_text' in prop:
+        parts = prop.get('title', prop.get('rich_text')) or []
+        return ''.join(part['text']['content'] for part in parts)
+    if 'number' in prop: return prop['number']
+    if 'select' in prop: return (prop['select'] or {}).get('name')
+    if 'date' in prop: return _parse_date((prop['date'] or {}).get('start'))
+    if 'relation' in prop: return [item['id'] for item in prop['relation']]
+    return None
+
+
+def _parse_date(value):
+    if not value: return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _now():
+    """Notion reports created_time and last_edited_time rounded down to the minute."""
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def _in_bounds(value, bounds):
+    if value is None: return False
+    if 'on_or_after' in bounds and value < _parse_date(bounds['on_or_after']): return False
+    if 'on_or_before' in bounds and value > _parse_date(bounds['on_or_before']): return False
+    if 'after' in bounds and value <= _parse_date(bounds['after']): return False
+    if 'before' in bounds and value >= _parse_date(bounds['before']): return False
+    return True
+
+
+class FakeNotion:
+    def __init__(self, latency=0.0, jitter=0.0, page_size=100, rate_limit=None, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.databases = {}
+        self.pages = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._window = []
+        self.server = None
+        self.app = self._build_app()
+
+    # -- data -------------------------------------------------------------
+    def add_page(self, database_id, properties):
+        now = _now()
+        page = {'object': 'page', 'id': str(uuid.uuid4()), 'created_time': now, 'last_edited_time': now, 'archived': False, 'parent': {'database_id': database_id}, 'properties': properties}
+        with self._lock:
+            self.databases.setdefault(database_id, []).append(page)
+            self.pages[page['id']] = page
+        return page
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    # -- behaviour --------------------------------------------------------
+    def _throttled(self):
+        """True if this call should get a 429, either at random or because it exceeds `rate_limit` req/s."""
+        if self.error_rate and random.random() < self.error_rate: return True
+        if not self.rate_limit: return False
+        with self._lock:
+            now = time.monotonic()
+            self._window = [stamp for stamp in self._window if now - stamp < 1.0]
+            if len(self._window) >= self.rate_limit: return True
+            self._window.append(now)
+        return False
+
+    def _enter(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+        if self._throttled():
+            return jsonify({'object': 'error', 'status': 429, 'code': 'rate_limited', 'message': 'Rate limited'}), 429, {'Retry-After': '1'}
+        return None
+
+    def _matches(self, page, condition):
+        if 'and' in condition: return all(self._matches(page, part) for part in condition['and'])
+        if 'or' in condition: return any(self._matches(page, part) for part in condition['or'])
+        if 'timestamp' in condition: return _in_bounds(_parse_date(page[condition['timestamp']]), condition[condition['timestamp']])
+        value = _plain(page['properties'].get(condition['property']))
+        if 'relation' in condition: return condition['relation']['contains'] in (value or [])
+        for kind in ('title', 'rich_text', 'select', 'number'):
+            if kind in condition:
+                if 'equals' in condition[kind]: return value == condition[kind]['equals']
+                if 'contains' in condition[kind]: return condition[kind]['contains'] in (value or '')
+        if 'date' in condition: return _in_bounds(value, condition['date'])
+        return True
+
+    def query(self, database_id, body):
+        with self._lock:
+            rows = [page for page in self.databases.get(database_id, []) if not page['archived']]
+        if body.get('filter'): rows = [page for page in rows if self._matches(page, body['filter'])]
+        for sort in reversed(body.get('sorts', [])):
+            if 'timestamp' in sort: rows.sort(key=lambda page: page[sort['timestamp']], reverse=sort.get('direction') == 'descending'); continue
+            rows.sort(key=lambda page: (_plain(page['properties'].get(sort['property'])) is None, _plain(page['properties'].get(sort['property'])) or 0), reverse=sort.get('direction') == 'descending')
+        size = min(int(body.get('page_size', 100)), 100, self.page_size)
+        start = int(body.get('start_cursor') or 0)
+        chunk = rows[start:start + size]
+        has_more = start + size < len(rows)
+        return {'object': 'list', 'results': chunk, 'has_more': has_more, 'next_cursor': str(start + size) if has_more else None}
+
+    def _build_app(self):
+        app = Flask('fake_notion')
+
+        @app.post('/v1/databases/<database_id>/query')
+        def query_database(database_id):
+            return self._enter('query') or jsonify(self.query(database_id, request.get_json(silent=True) or {}))
+
+        @app.post('/v1/pages')
+        def create_page():
+            throttled = self._enter('create')
+            if throttled: return throttled
+            body = request.get_json()
+            return jsonify(self.add_page(body['parent']['database_id'], body['properties']))
+
+        @app.patch('/v1/pages/<page_id>')
+        def update_page(page_id):
+            throttled = self._enter('update')
+            if throttled: return throttled
+            body = request.get_json()
+            with self._lock:
+                page = self.pages.get(page_id)
+                if page is None: return jsonify({'object': 'error', 'status': 404, 'code': 'object_not_found'}), 404
+                if 'archived' in body: page['archived'] = body['archived']
+                page['properties'].update(body.get('properties', {}))
+                page['last_edited_time'] = _now()
+            return jsonify(page)
+
+        @app.get('/_stats')
+        def stats():
+            with self._lock:
+                return jsonify({'calls': dict(self.calls), 'databases': {key: len(value) for key, value in self.databases.items()}})
+
+        return app
+
+    # -- serving ----------------------------------------------------------
+    def start(self, host='127.0.0.1', port=0):
+        """Serves on a background thread and returns the base URL to use as NOTION_API_URL."""
+        from werkzeug.serving import make_server
+        self.server = make_server(host, port, self.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name='fake-notion', daemon=True).start()
+        return f"http://{host}:{self.server.server_port}/v1"
+
+    def stop(self):
+        if self.server: self.server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency, up to this many seconds')
+    parser.add_argument('--page-size', type=int, default=100, help='maximum results per query page')
+    parser.add_argument('--rate-limit', type=float, default=None, help='answer 429 above this many requests per second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 429')
+    args = parser.parse_args()
+    fake = FakeNotion(args.latency, args.jitter, args.page_size, args.rate_limit, args.error_rate)
+    fake.app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import math
+
+EARTH_RADIUS_M = 6371e3
+# Bounding boxes are widened by this factor so float rounding never puts a boundary point outside them.
+BOX_MARGIN = 1.001
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between two points given in degrees."""
+    phi1 = math.radians(lat1); phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1); delta_lambda = math.radians(lon2 - lon1)
+    a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
+    return EARTH_RADIUS_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class GeofenceSet:
+    """Geofence zones compiled into a uniform lat/lon grid.
+
+    Each zone is registered in every `cell_deg` cell its bounding box touches,
+    so a lookup only looks at zones from the point's own cell, rejects most
+    of them with a cheap bounding-box test and runs haversine on the rest.
+    Zones spanning more than `max_cells` cells are kept in a short list that is
+    checked for every point instead of bloating the grid.
+    """
+
+    def __init__(self, zones, cell_deg=0.1, max_cells=256):
+        self.cell_deg = cell_deg
+        self._columns = int(round(360 / cell_deg))
+        self._grid = {}
+        self._wide = []
+        self._compiled = []
+        self.zones = []
+        for zone in zones:
+            if zone.get('lat') is None or zone.get('lon') is None or not zone.get('radius'):
+                continue
+            self.zones.append(zone)
+            half_lat, half_lon = self._half_extents(zone['lat'], zone['radius'])
+            cos_lat = math.cos(math.radians(zone['lat']))
+            index = len(self._compiled)
+            self._compiled.append((zone, zone['lat'], zone['lon'], zone['radius'], half_lat, half_lon, cos_lat))
+            rows = range(self._row(zone['lat'] - half_lat), self._row(zone['lat'] + half_lat) + 1)
+            columns = range(self._raw_column(zone['lon'] - half_lon), self._raw_column(zone['lon'] + half_lon) + 1)
+            if len(rows) * len(columns) > max_cells:
+                self._wide.append(index)
+                continue
+            for row in rows:
+                for column in columns:
+                    self._grid.setdefault((row, column % self._columns), []).append(index)
+
+    @staticmethod
+    def _half_extents(lat, radius):
+        """Half the height and width in degrees of the box around a circle of `radius` metres,
+        on the same sphere as `haversine`. The widest point of the circle is asin(sin d / cos lat)
+        degrees of longitude from its centre (d the angular radius), not d / cos lat."""
+        angle = radius / EARTH_RADIUS_M
+        half_lat = min(180.0, math.degrees(angle) * BOX_MARGIN)
+        cos_lat = math.cos(math.radians(lat))
+        # A circle reaching over a pole covers every longitude.
+        if abs(lat) + math.degrees(angle) >= 90 or math.sin(angle) >= cos_lat: return half_lat, 180.0
+        return half_lat, min(180.0, math.degrees(math.asin(math.sin(angle) / cos_lat)) * BOX_MARGIN)
+
+    def _row(self, lat): return int(math.floor((lat + 90) / self.cell_deg))
+    def _raw_column(self, lon): return int(math.floor((lon + 180) / self.cell_deg))
+    def _cell(self, lat, lon): return (self._row(lat), self._raw_column(lon) % self._columns)
+
+    def _candidates(self, cell):
+        return self._grid.get(cell, []) + self._wide
+
+    def _test(self, indexes, lat, lon, cos_phi):
+        matched = []
+        for index in indexes:
+            zone, zone_lat, zone_lon, radius, half_lat, half_lon, zone_cos = self._compiled[index]
+            if abs(lat - zone_lat) > half_lat: continue
+            delta_lon = abs(lon - zone_lon) % 360
+            if min(delta_lon, 360 - delta_lon) > half_lon: continue
+            a = math.sin(math.radians(zone_lat - lat) / 2)**2 + cos_phi * zone_cos * math.sin(math.radians(zone_lon - lon) / 2)**2
+            if EARTH_RADIUS_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)) <= radius:
+                matched.append(zone)
+        return matched
+
+    def matches(self, lat, lon):
+        """Returns every zone containing the point, not just the first one."""
+        lat = float(lat); lon = float(lon)
+        return self._test(self._candidates(self._cell(lat, lon)), lat, lon, math.cos(math.radians(lat)))
+
+    def matches_many(self, points):
+        """Batch form of `matches` for an iterable of (lat, lon) pairs.
+
+        Points are grouped by grid cell so each cell's candidate list is built
+        once per batch rather than once per point.
+        """
+        results = []; candidates = {}
+        for lat, lon in points:
+            lat = float(lat); lon = float(lon)
+            cell = self._cell(lat, lon)
+            indexes = candidates.get(cell)
+            if indexes is None: indexes = candidates[cell] = self._candidates(cell)
+            results.append(self._test(indexes, lat, lon, math.cos(math.radians(lat))) if indexes else [])
+        return results
+
+    def __len__(self):
+        return len(self.zones)
@@ -0,0 +1,274 @@
+import glob
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+
+from cache import TTLCache
+
+INGEST_MODE = os.getenv('LOCATION_INGEST_MODE', 'sync' if os.getenv('VERCEL') else 'async')
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '10'))
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'locsent-spool'))
+INGEST_DEDUP_SIZE = int(os.getenv('INGEST_DEDUP_SIZE', '100000'))
+INGEST_DEDUP_TTL = float(os.getenv('INGEST_DEDUP_TTL', '86400'))
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Spool:
+    """Append-only JSON-lines journal of accepted pings and their acknowledgements.
+
+    Every process writes its own `spool-<pid>.jsonl`; on start-up a process also
+    adopts the journals of processes that are no longer running, so pings
+    accepted before a restart or crash are replayed rather than lost (see
+    `recover`).
+    """
+
+    def __init__(self, directory, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, f"spool-{os.getpid()}.jsonl")
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _write(self, records):
+        with self._lock:
+            for record in records:
+                self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            if self.fsync: os.fsync(self._file.fileno())
+
+    def put(self, pings): self._write([{"op": "put", "ping": ping} for ping in pings])
+    def ack(self, ping_ids, op="ack"): self._write([{"op": op, "id": ping_id} for ping_id in ping_ids])
+
+    def _claim(self, path):
+        """Takes a journal over by renaming it to `claimed-<our pid>-<original name>`. The rename
+        is atomic, so when several processes start together only one of them gets each file."""
+        name = os.path.basename(path)
+        if name.startswith("claimed-"): name = name.split("-", 2)[2]
+        claimed = os.path.join(self.directory, f"claimed-{os.getpid()}-{name}")
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        return claimed
+
+    def recover(self):
+        """Returns unacknowledged pings from this process's journal and from dead processes'
+        journals, after saving them into this process's journal. Dead journals are claimed
+        first and only deleted once their pings are saved, so they are replayed exactly once
+        and survive a crash part way through."""
+        claimed = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "spool-*.jsonl")) + glob.glob(os.path.join(self.directory, "claimed-*.jsonl"))):
+            if path == self.path: continue
+            name = os.path.basename(path)
+            try:
+                # spool-<pid>.jsonl, or claimed-<pid>-... left by a recovery that didn't finish.
+                pid = int(name[6:-6]) if name.startswith("spool-") else int(name.split("-")[1])
+            except (ValueError, IndexError):
+                continue
+            # A pid equal to ours belongs to an earlier process (pids are reused after restarts).
+            if pid != os.getpid() and _pid_alive(pid): continue
+            path = self._claim(path)
+            if path: claimed.append(path)
+        pending = {}
+        for path in [self.path] + claimed: self._replay(path, pending)
+        pending = list(pending.values())
+        self.compact(pending)
+        for path in claimed: os.remove(path)
+        return pending
+
+    @staticmethod
+    def _replay(path, pending):
+        """Applies the journal at `path` to `pending` (ping id -> ping): puts add, acks remove."""
+        try:
+            with open(path, encoding='utf-8') as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("op") == "put": pending[record["ping"]["id"]] = record["ping"]
+                    else: pending.pop(record.get("id"), None)
+        except OSError:
+            pass
+
+    def compact(self, pings=None):
+        """Rewrites the journal so it holds only `pings`, by default the ones it holds no
+        acknowledgement for. The default is read from the journal itself, so a ping a worker
+        has taken off the queue but not yet written is kept whatever the queue looks like."""
+        with self._lock:
+            self._file.close()
+            if pings is None:
+                pending = {}; self._replay(self.path, pending); pings = list(pending.values())
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as handle:
+                for ping in pings:
+                    handle.write(json.dumps({"op": "put", "ping": ping}) + "\n")
+                handle.flush()
+                if self.fsync: os.fsync(handle.fileno())
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+
+class IngestPipeline:
+    """Write-behind queue between `/user/send_location` and Notion.
+
+    `enqueue` journals the ping to the spool and returns immediately. Worker
+    threads drain the queue in batches of up to `batch_size` through
+    `write_batch`, which returns True (written), None (transient failure,
+    retried with capped exponential backoff for as long as it takes) or False
+    (rejected, or possibly written despite the error; dropped and counted rather
+    than sent again, which could duplicate it).
+    """
+
+    def __init__(self, write_batch, spool, workers=2, batch_size=10, compact_bytes=1 << 20):
+        self.write_batch = write_batch
+        self.spool = spool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.compact_bytes = compact_bytes
+        self._queue = queue.Queue()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self._failures = 0
+        self.counters = {'enqueued': 0, 'written': 0, 'retried': 0, 'dropped': 0, 'recovered': 0, 'batches': 0}
+        self.last_lag = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._started: return
+            self._started = True
+        recovered = self.spool.recover()
+        for ping in recovered: self._queue.put(ping)
+        self.counters['recovered'] += len(recovered)
+        for index in range(self.workers):
+            threading.Thread(target=self._run, name=f"ingest-{index}", daemon=True).start()
+
+    def enqueue(self, **ping):
+        return self.enqueue_many([ping])
+
+    def enqueue_many(self, pings):
+        self.start()
+        now = time.time()
+        pings = [{**ping, 'id': uuid.uuid4().hex, 'enqueued_at': now, 'attempts': 0} for ping in pings]
+        with self._lock:
+            self.spool.put(pings)
+            for ping in pings: self._queue.put(ping)
+            self.counters['enqueued'] += len(pings)
+        return len(pings)
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock: self._in_flight += len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            self.last_lag = time.time() - min(ping['enqueued_at'] for ping in batch)
+            fields = [{key: value for key, value in ping.items() if key not in ('id', 'enqueued_at', 'attempts')} for ping in batch]
+            try:
+                results = self.write_batch(fields)
+            except Exception as exc:
+                logger.error(f"INGEST ERROR: {exc}")
+                results = [None] * len(batch)
+            done = []; dropped = []; retry = []
+            for ping, result in zip(batch, results):
+                if result: done.append(ping['id']); continue
+                if result is False: dropped.append(ping['id']); continue
+                ping['attempts'] += 1
+                retry.append(ping)
+            if done: self.spool.ack(done)
+            if dropped: self.spool.ack(dropped, op="drop")
+            with self._lock:
+                self.counters['batches'] += 1
+                self.counters['written'] += len(done)
+                self.counters['dropped'] += len(dropped)
+                self.counters['retried'] += len(retry)
+                self._failures = self._failures + 1 if retry else 0
+                failures = self._failures
+            if retry:
+                time.sleep(min(60.0, 0.5 * 2 ** min(failures, 7)))
+                for ping in retry: self._queue.put(ping)
+            with self._lock:
+                self._in_flight -= len(batch)
+                if self._in_flight == 0 and self._queue.empty() and self.spool.size() > self.compact_bytes:
+                    self.spool.compact()
+
+    def stats(self):
+        with self._queue.mutex:
+            queued = list(self._queue.queue)
+        with self._lock:
+            return {
+                'mode': INGEST_MODE,
+                'depth': len(queued),
+                'in_flight': self._in_flight,
+                'oldest_queued_seconds': time.time() - min(ping['enqueued_at'] for ping in queued) if queued else 0.0,
+                'last_batch_lag_seconds': self.last_lag,
+                'spool_bytes': self.spool.size(),
+                **self.counters,
+            }
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """Returns the process-wide pipeline, creating it on first use."""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                from models import log_locations
+                _pipeline = IngestPipeline(log_locations, Spool(INGEST_SPOOL_DIR), workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE)
+    return _pipeline
+
+
+# (user_page_id, device timestamp) of recently accepted pings, so a device re-sending a
+# batch whose response it never received does not log the same points twice.
+recent_pings = TTLCache(INGEST_DEDUP_SIZE, INGEST_DEDUP_TTL)
+
+
+def drop_duplicates(pings):
+    """Returns `pings` without repeats of a (user, timestamp) seen earlier in the list or recently accepted."""
+    fresh = []; seen = set()
+    for ping in pings:
+        key = (ping['user_page_id'], ping['timestamp'])
+        if key in seen or recent_pings.get(key): continue
+        seen.add(key); fresh.append(ping)
+    return fresh
+
+
+def remember(pings):
+    """Marks pings as accepted for `drop_duplicates`."""
+    for ping in pings: recent_pings.set((ping['user_page_id'], ping['timestamp']), True)
@@ -0,0 +1,102 @@
+import json
+import os
+import queue
+import threading
+import time
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_MAX_SECONDS = float(os.getenv('SSE_MAX_SECONDS', '300'))
+# The broadcaster only reaches streams in the process that handled the ping, and each stream holds a
+# worker open. Serverless instances never share a process, so Vercel defaults to polling only.
+LIVE_FEED_ENABLED = os.getenv('LIVE_FEED', 'false' if os.getenv('VERCEL') else 'true').lower() == 'true'
+
+
+class Broadcaster:
+    """Fans events published by `send_location` out to every open SSE stream.
+
+    Each subscriber gets a bounded queue; a subscriber that falls
+    `queue_size` events behind is disconnected (its EventSource reconnects and
+    re-syncs) instead of making publishers wait. Positions are only published
+    when they differ from the last one sent for that user.
+    """
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._last_positions = {}
+        self._last_zones = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_page_id=None):
+        """Returns a queue receiving every event, or only `user_page_id`'s events if given."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock: self._subscribers[subscriber] = user_page_id
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock: self._subscribers.pop(subscriber, None)
+
+    def publish(self, event, data, user_page_id=None):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self._lock:
+            self.published += 1
+            subscribers = list(self._subscribers.items())
+        for subscriber, only_user in subscribers:
+            if only_user is not None and only_user != user_page_id: continue
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                self.dropped += 1
+                self.unsubscribe(subscriber)
+                with subscriber.mutex: subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+    def publish_position(self, user_page_id, username, position):
+        """Publishes a `position` event unless the user has not moved since the last one."""
+        key = (position['latitude'], position['longitude'])
+        with self._lock:
+            if self._last_positions.get(user_page_id) == key: return False
+            self._last_positions[user_page_id] = key
+        self.publish('position', {'username': username, **position}, user_page_id)
+        return True
+
+    def publish_zones(self, user_page_id, username, zones, position):
+        """Publishes `geofence` events only for zones the user has just entered."""
+        names = {zone['name'] for zone in zones}
+        with self._lock:
+            entered = names - self._last_zones.get(user_page_id, set())
+            self._last_zones[user_page_id] = names
+        for name in sorted(entered):
+            self.publish('geofence', {'username': username, 'zone': name, **position}, user_page_id)
+        return entered
+
+    def forget(self, user_page_id):
+        with self._lock:
+            self._last_positions.pop(user_page_id, None)
+            self._last_zones.pop(user_page_id, None)
+
+    def stream(self, subscriber, heartbeat=SSE_HEARTBEAT_SECONDS, max_seconds=SSE_MAX_SECONDS):
+        """Yields SSE frames for `subscriber` until the client goes away or `max_seconds`
+        pass, after which the browser's EventSource reconnects on its own."""
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=min(heartbeat, max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None: return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'published': self.published, 'dropped_subscribers': self.dropped}
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class LatestLocationIndex:
+    """In-process map of user page id -> last known position.
+
+    `models.log_location` writes through to it and the admin map reads from it,
+    so the map endpoint no longer needs one Notion query per user.
+    """
+
+    def __init__(self):
+        self._positions = {}
+        self._lock = threading.Lock()
+        # Held by whoever is rebuilding or refreshing, so concurrent readers don't all query Notion.
+        self.refresh_lock = threading.Lock()
+        self.built = False
+        self.watermark = None
+        self.refreshed_at = 0.0
+
+    def update(self, user_page_id, position):
+        """Stores `position` unless a newer one is already indexed for the user."""
+        with self._lock:
+            current = self._positions.get(user_page_id)
+            if current and current['timestamp'] > position['timestamp']:
+                return
+            self._positions[user_page_id] = position
+
+    def get(self, user_page_id):
+        with self._lock:
+            return self._positions.get(user_page_id)
+
+    def discard(self, user_page_id):
+        with self._lock:
+            self._positions.pop(user_page_id, None)
+
+    def replace(self, positions, watermark=None):
+        """Swaps in a freshly rebuilt index, keeping any newer live writes."""
+        with self._lock:
+            for user_page_id, position in self._positions.items():
+                rebuilt = positions.get(user_page_id)
+                if not rebuilt or rebuilt['timestamp'] < position['timestamp']:
+                    positions[user_page_id] = position
+            self._positions = positions
+            self.built = True
+        self.mark_refreshed(watermark)
+
+    def mark_refreshed(self, watermark=None):
+        """Records a successful read from the location store.
+
+        Only the store's own watermark (opaque, see LocationStore.rows_since)
+        moves it; local writes don't, so pings written by other workers are
+        never skipped.
+        """
+        if watermark is not None: self.watermark = watermark
+        self.refreshed_at = time.monotonic()
+
+    def is_stale(self, max_age):
+        return not self.built or time.monotonic() - self.refreshed_at > max_age
+
+    def __len__(self):
+        with self._lock:
+            return len(self._positions)
@@ -0,0 +1,279 @@
+import bisect
+import contextvars
+import cProfile
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, request
+from flask_login import current_user
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_LOG_JSON = os.getenv('METRICS_LOG_JSON', '').lower() in ('1', 'true', 'yes')
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', '0'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '1'))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger(__name__)
+
+# The model-layer function currently running, used to label the Notion calls it makes.
+_operation = contextvars.ContextVar('locsent_operation', default='other')
+# Per-request Notion call tally for the access log; a dict so worker threads can add to it.
+_request_stats = contextvars.ContextVar('locsent_request_stats', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name; self.help = help; self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock: values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name; self.help = help; self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None: entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1; entry[1] += value; entry[2] += 1
+
+    def render(self):
+        with self._lock: values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Holds the process's metrics and renders them in the Prometheus text format.
+
+    Collectors are callables run at scrape time that return
+    (name, type, help, [(labels, value), ...]) tuples, for values that live
+    elsewhere (cache sizes, queue depths) and are cheaper to read than to track.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames); self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets); self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        self._collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics: lines += metric.render()
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception:
+                logger.exception("METRICS ERROR (collector %s)", getattr(collect, '__name__', collect))
+                continue
+            for name, kind, help, samples in families:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_labels(labels.keys(), labels.values())} {value}" for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+HTTP_REQUESTS = registry.histogram('locsent_http_request_duration_seconds', 'Time to produce a response (headers, for streamed bodies), by route.', ('endpoint', 'method', 'status'))
+OPERATIONS = registry.histogram('locsent_operation_duration_seconds', 'Time spent in model-layer functions, by function.', ('operation', 'outcome'))
+NOTION_REQUESTS = registry.histogram('locsent_notion_request_duration_seconds', 'Outbound Notion API requests (one per attempt), by calling function.', ('operation', 'method', 'status'))
+NOTION_THROTTLE_WAIT = registry.histogram('locsent_notion_throttle_wait_seconds', 'Time spent waiting on the client-side Notion rate limiter.', ('operation',))
+NOTION_RETRIES = registry.counter('locsent_notion_retries_total', 'Notion requests retried, by reason (HTTP status or connection).', ('operation', 'reason'))
+NOTION_RATE_LIMITED = registry.counter('locsent_notion_rate_limited_total', '429 responses received from Notion.', ('operation',))
+
+
+def current_operation():
+    return _operation.get()
+
+
+def instrument(name):
+    """Times a model-layer function and labels the Notion calls made inside it with `name`.
+    Generator functions are timed over their whole iteration."""
+    def decorate(function):
+        if inspect.isgeneratorfunction(function):
+            @wraps(function)
+            def generator(*args, **kwargs):
+                elapsed = 0.0; outcome = 'ok'
+                iterator = function(*args, **kwargs)
+                try:
+                    while True:
+                        token = _operation.set(name); started = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        except Exception:
+                            outcome = 'error'; raise
+                        finally:
+                            elapsed += time.perf_counter() - started; _operation.reset(token)
+                        yield item
+                finally:
+                    iterator.close()
+                    OPERATIONS.observe(elapsed, operation=name, outcome=outcome)
+            return generator
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            token = _operation.set(name); started = time.perf_counter(); outcome = 'ok'
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                outcome = 'error'; raise
+            finally:
+                OPERATIONS.observe(time.perf_counter() - started, operation=name, outcome=outcome)
+                _operation.reset(token)
+        return wrapper
+    return decorate
+
+
+def observe_notion(method, status, seconds):
+    """Records one Notion request attempt; called by NotionClient."""
+    operation = _operation.get()
+    NOTION_REQUESTS.observe(seconds, operation=operation, method=method, status=status)
+    if status == 429: NOTION_RATE_LIMITED.inc(operation=operation)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats['notion_calls'] += 1; stats['notion_seconds'] += seconds
+
+
+def observe_throttle(seconds):
+    NOTION_THROTTLE_WAIT.observe(seconds, operation=_operation.get())
+
+
+def observe_retry(reason):
+    NOTION_RETRIES.inc(operation=_operation.get(), reason=reason)
+
+
+@registry.collector
+def _app_gauges():
+    from models import user_cache, username_cache, track_cache, app_cache
+    from ingest import INGEST_MODE, get_pipeline, recent_pings
+    from live_feed import broadcaster
+    caches = {'user': user_cache.stats(), 'username': username_cache.stats(), 'track': track_cache.stats(), 'app': app_cache.stats(), 'ping_dedup': recent_pings.stats()}
+    yield 'locsent_cache_hits_total', 'counter', 'Cache lookups answered from the cache.', [({'cache': name}, stats['hits']) for name, stats in caches.items()]
+    yield 'locsent_cache_misses_total', 'counter', 'Cache lookups that missed.', [({'cache': name}, stats['misses']) for name, stats in caches.items()]
+    yield 'locsent_cache_hit_ratio', 'gauge', 'Hits over lookups since start-up.', [({'cache': name}, stats['hit_ratio']) for name, stats in caches.items()]
+    yield 'locsent_cache_entries', 'gauge', 'Entries currently cached.', [({'cache': name}, stats['size']) for name, stats in caches.items()]
+    if INGEST_MODE == 'async':
+        stats = get_pipeline().stats()
+        for key in ('depth', 'in_flight', 'oldest_queued_seconds', 'last_batch_lag_seconds', 'spool_bytes'):
+            yield f'locsent_ingest_{key}', 'gauge', f'Ingest pipeline {key.replace("_", " ")}.', [({}, stats[key] or 0)]
+        for key in ('enqueued', 'written', 'retried', 'dropped', 'recovered', 'batches'):
+            yield f'locsent_ingest_{key}_total', 'counter', f'Pings (or batches) {key} by the ingest pipeline.', [({}, stats[key])]
+    stats = broadcaster.stats()
+    yield 'locsent_live_subscribers', 'gauge', 'Open live-map event streams.', [({}, stats['subscribers'])]
+    yield 'locsent_live_events_published_total', 'counter', 'Live-map events published.', [({}, stats['published'])]
+    yield 'locsent_live_dropped_subscribers_total', 'counter', 'Live-map streams dropped for falling behind.', [({}, stats['dropped_subscribers'])]
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info: entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _metrics_view():
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}": return Response('Unauthorized\n', 401)
+    elif not (current_user.is_authenticated and current_user.role == 'Admin'):
+        return Response('Forbidden\n', 403)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Times every request, serves /metrics and, if enabled, writes JSON access logs and
+    profiles slow requests."""
+    if METRICS_LOG_JSON:
+        handler = logging.StreamHandler(); handler.setFormatter(JSONFormatter())
+        root = logging.getLogger(); root.handlers = [handler]; root.setLevel(logging.INFO)
+    profile_lock = threading.Lock()
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        _request_stats.set({'notion_calls': 0, 'notion_seconds': 0.0})
+        # cProfile can only run one profiler at a time, so concurrent requests are skipped.
+        if PROFILE_SLOW_MS and random.random() < PROFILE_SAMPLE_RATE and profile_lock.acquire(blocking=False):
+            g.profile_started = time.perf_counter(); g.profiler = cProfile.Profile(); g.profiler.enable()
+
+    @app.after_request
+    def _record(response):
+        started = g.pop('metrics_started', None)
+        if started is None: return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        if METRICS_LOG_JSON:
+            stats = _request_stats.get() or {}
+            logger.info("request", extra={'fields': {'method': request.method, 'path': request.path, 'endpoint': endpoint, 'status': response.status_code, 'duration_ms': round(elapsed * 1000, 2), 'notion_calls': stats.get('notion_calls', 0), 'notion_ms': round(stats.get('notion_seconds', 0.0) * 1000, 2), 'user': current_user.get_id() if current_user.is_authenticated else None}})
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc=None):
+        profiler = g.pop('profiler', None)
+        if profiler is None: return
+        profiler.disable(); profile_lock.release()
+        elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+        if elapsed_ms < PROFILE_SLOW_MS: return
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(25)
+        logger.warning("SLOW REQUEST %s %s took %.0f ms\n%s", request.method, request.path, elapsed_ms, output.getvalue())
+        if PROFILE_DIR:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{request.endpoint or 'unmatched'}.prof"))
+
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
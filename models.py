@@ -1,20 +1,48 @@
-import requests
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-import math
+import threading
+import time
+from cache import TTLCache, VersionedCache
+from geofence_index import GeofenceSet
+from location_index import LatestLocationIndex
+from metrics import instrument
+from notion_client import NotionClient, NotionError, DEFAULT_API_URL, never_sent
+from trajectory import douglas_peucker, time_bucket_decimate
+from tracks import Track, epoch
+from storage import LocationStore, SQLiteLocationStore, MirroredLocationStore, normalize_timestamp, position_of, history_of, export_of
 
 NOTION_API_KEY = os.getenv('NOTION_API_KEY')
 USERS_DB_ID = os.getenv('NOTION_DATABASE_ID_USERS')
 LOCATIONS_DB_ID = os.getenv('NOTION_DATABASE_ID_LOCATIONS')
 GEOFENCES_DB_ID = os.getenv('NOTION_DATABASE_ID_GEOFENCES')
 SETTINGS_DB_ID = os.getenv('NOTION_DATABASE_ID_SETTINGS') 
+LATEST_INDEX_MAX_AGE = float(os.getenv('LATEST_INDEX_MAX_AGE', '15'))
+LATEST_INDEX_REBUILD_PAGES = int(os.getenv('LATEST_INDEX_REBUILD_PAGES', '10'))
+LATEST_INDEX_WATERMARK_LAG = float(os.getenv('LATEST_INDEX_WATERMARK_LAG', '120'))
+LOCATION_STORAGE = os.getenv('LOCATION_STORAGE', 'notion')
+LOCATION_DB_PATH = os.getenv('LOCATION_DB_PATH', 'locations.db')
+MIRROR_SYNC_SECONDS = float(os.getenv('MIRROR_SYNC_SECONDS', '60'))
+MIRROR_RECONCILE_SECONDS = float(os.getenv('MIRROR_RECONCILE_SECONDS', '3600'))
+GEOFENCE_TTL = float(os.getenv('GEOFENCE_TTL', '60'))
+GEOFENCE_CELL_DEG = float(os.getenv('GEOFENCE_CELL_DEG', '0.1'))
+# Notion serves 100 rows per call at ~3 calls/s, so a Notion-backed load is kept to well under a minute.
+HISTORY_MAX_ROWS = int(os.getenv('HISTORY_MAX_ROWS', '5000' if LOCATION_STORAGE == 'notion' else '50000'))
+ANALYTICS_MAX_ROWS = int(os.getenv('ANALYTICS_MAX_ROWS', '5000' if LOCATION_STORAGE == 'notion' else '1000000'))
+ANALYTICS_DEFAULT_DAYS = float(os.getenv('ANALYTICS_DEFAULT_DAYS', '30'))
 
-HEADERS = {
-    "Authorization": f"Bearer {NOTION_API_KEY}",
-    "Content-Type": "application/json",
-    "Notion-Version": "2022-06-28"
-}
+logger = logging.getLogger(__name__)
+
+notion = NotionClient(NOTION_API_KEY, base_url=os.getenv('NOTION_API_URL', DEFAULT_API_URL), rate_limit=float(os.getenv('NOTION_RATE_LIMIT', '3')), max_workers=int(os.getenv('NOTION_MAX_WORKERS', '4')))
+
+latest_location_index = LatestLocationIndex()
+app_cache = VersionedCache(ttl=float(os.getenv('APP_CACHE_TTL', '60')))
+user_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', '1024')), ttl=float(os.getenv('USER_CACHE_TTL', '300')))
+username_cache = TTLCache(maxsize=user_cache.maxsize, ttl=user_cache.ttl)
+track_cache = TTLCache(maxsize=int(os.getenv('ANALYTICS_CACHE_SIZE', '32')), ttl=float(os.getenv('ANALYTICS_CACHE_TTL', '600')))
+_track_lock = threading.Lock(); _track_locks = {}
+_geofence_set = None; _geofence_expires = 0.0; _geofence_lock = threading.Lock()
 
 class User:
     def __init__(self, id, page_id, username, role, password_hash):
@@ -23,49 +51,76 @@ class User:
     def get_id(self): return self.id
     def is_authenticated(self): return True
     @staticmethod
+    @instrument('User.get')
     def get(user_id):
-        url = f"https://api.notion.com/v1/databases/{USERS_DB_ID}/query"
+        """Looks a user up by UserID, serving repeat lookups from `user_cache`."""
+        user = user_cache.get(user_id)
+        if user is not None: return user
+        user = User._fetch(user_id)
+        if user is not None: User._remember(user)
+        return user
+    @staticmethod
+    def _remember(user):
+        user_cache.set(user.id, user); username_cache.set(user.username, user)
+    @staticmethod
+    def _from_page(page):
+        props = page['properties']
+        return User(id=props['UserID']['title'][0]['text']['content'], page_id=page['id'], username=props['Username']['rich_text'][0]['text']['content'], role=props['Role']['select']['name'], password_hash=props['PasswordHash']['rich_text'][0]['text']['content'])
+    @staticmethod
+    def _fetch(user_id):
+        path = f"databases/{USERS_DB_ID}/query"
         query = {"filter": {"property": "UserID", "title": {"equals": user_id}}}
-        response = requests.post(url, json=query, headers=HEADERS)
-        if response.status_code != 200: print(f"NOTION API ERROR (get): {response.json()}"); return None
+        response = notion.post(path, json=query)
+        if response.status_code != 200: logger.error(f"NOTION API ERROR (get): {response.json()}"); return None
         data = response.json()
-        if data.get('results'):
-            user_data = data['results'][0]; props = user_data['properties']
-            return User(id=props['UserID']['title'][0]['text']['content'], page_id=user_data['id'], username=props['Username']['rich_text'][0]['text']['content'], role=props['Role']['select']['name'], password_hash=props['PasswordHash']['rich_text'][0]['text']['content'])
+        if data.get('results'): return User._from_page(data['results'][0])
         return None
     @staticmethod
-    def get_by_username(username):
-        url = f"https://api.notion.com/v1/databases/{USERS_DB_ID}/query"
+    @instrument('User.get_by_username')
+    def get_by_username(username, use_cache=True):
+        """Looks a user up by username, serving repeat lookups (e.g. logins) from `username_cache`."""
+        user = username_cache.get(username) if use_cache else None
+        if user is not None: return user
+        path = f"databases/{USERS_DB_ID}/query"
         query = {"filter": {"property": "Username", "rich_text": {"equals": username}}}
-        response = requests.post(url, json=query, headers=HEADERS)
-        if response.status_code != 200: print(f"NOTION API ERROR (get_by_username): {response.json()}"); return None
+        response = notion.post(path, json=query)
+        if response.status_code != 200: logger.error(f"NOTION API ERROR (get_by_username): {response.json()}"); return None
         data = response.json()
         if data.get('results'):
-            user_data = data['results'][0]; props = user_data['properties']
-            return User(id=props['UserID']['title'][0]['text']['content'], page_id=user_data['id'], username=props['Username']['rich_text'][0]['text']['content'], role=props['Role']['select']['name'], password_hash=props['PasswordHash']['rich_text'][0]['text']['content'])
+            user = User._from_page(data['results'][0])
+            User._remember(user)
+            return user
         return None
 
+@instrument('delete_user')
 def delete_user(user_page_id):
     """Archives a user page in Notion, effectively deleting them."""
-    url = f"https://api.notion.com/v1/pages/{user_page_id}"
+    path = f"pages/{user_page_id}"
     payload = {"archived": True}
-    response = requests.patch(url, json=payload, headers=HEADERS)
+    response = notion.patch(path, json=payload)
     if response.status_code != 200:
-        print(f"NOTION API ERROR (delete_user): {response.json()}")
+        logger.error(f"NOTION API ERROR (delete_user): {response.json()}")
         return False
+    user_cache.invalidate_where(lambda user: user.page_id == user_page_id)
+    username_cache.invalidate_where(lambda user: user.page_id == user_page_id)
+    app_cache.invalidate('users')
+    latest_location_index.discard(user_page_id)
+    track_cache.invalidate(user_page_id)
     return True
 
-def get_app_setting(setting_name):
-    """Fetches a specific setting from the AppSettings database."""
-    if not SETTINGS_DB_ID: return None
-    url = f"https://api.notion.com/v1/databases/{SETTINGS_DB_ID}/query"
+def _fetch_app_setting(setting_name):
+    path = f"databases/{SETTINGS_DB_ID}/query"
     query = {"filter": {"property": "Setting", "title": {"equals": setting_name}}}
-    response = requests.post(url, json=query, headers=HEADERS)
+    response = notion.post(path, json=query)
     if response.status_code != 200: return None
     data = response.json()
-    if data.get('results'):
-        return data['results'][0] 
-    return None
+    return data['results'][0] if data.get('results') else {}
+
+@instrument('get_app_setting')
+def get_app_setting(setting_name):
+    """Fetches a specific setting from the AppSettings database, via `app_cache`."""
+    if not SETTINGS_DB_ID: return None
+    return app_cache.get_or_load(('setting', setting_name), lambda: _fetch_app_setting(setting_name)) or None
 
 def is_signup_enabled():
     """Checks if the SignUpEnabled setting is true."""
@@ -75,115 +130,339 @@ def is_signup_enabled():
         return value.lower() == 'true'
     return True 
 
+@instrument('set_signup_status')
 def set_signup_status(enabled):
     """Updates the SignUpEnabled setting in Notion."""
     setting = get_app_setting('SignUpEnabled')
     if setting:
         page_id = setting['id']
-        url = f"https://api.notion.com/v1/pages/{page_id}"
+        path = f"pages/{page_id}"
         payload = {
             "properties": {
                 "Value": {"rich_text": [{"text": {"content": "true" if enabled else "false"}}]}
             }
         }
-        response = requests.patch(url, json=payload, headers=HEADERS)
+        response = notion.patch(path, json=payload)
         if response.status_code != 200:
-            print(f"NOTION API ERROR (set_signup_status): {response.json()}")
+            logger.error(f"NOTION API ERROR (set_signup_status): {response.json()}")
             return False
+        app_cache.set(('setting', 'SignUpEnabled'), {**setting, 'properties': {**setting['properties'], **payload['properties']}})
         return True
     return False
 
+@instrument('get_all_users')
 def get_all_users():
-    url = f"https://api.notion.com/v1/databases/{USERS_DB_ID}/query"
-    response = requests.post(url, headers=HEADERS)
-    if response.status_code != 200: print(f"NOTION API ERROR (get_all_users): {response.json()}"); return []
-    data = response.json(); users = []
-    if 'results' in data:
-        for item in data['results']:
+    """All users with the 'User' role, via `app_cache`."""
+    return app_cache.get_or_load('users', _fetch_all_users) or []
+def _fetch_all_users():
+    path = f"databases/{USERS_DB_ID}/query"
+    query = {"page_size": 100}; users = []
+    while True:
+        response = notion.post(path, json=query)
+        if response.status_code != 200: logger.error(f"NOTION API ERROR (get_all_users): {response.json()}"); return None
+        data = response.json()
+        for item in data.get('results', []):
             props = item['properties']
             if props.get('Role') and props['Role'].get('select') and props['Role']['select']['name'] == 'User':
                 users.append({'id': props['UserID']['title'][0]['text']['content'], 'page_id': item['id'], 'username': props['Username']['rich_text'][0]['text']['content'], 'role': props['Role']['select']['name']})
+            # The scan already carries every user's full row, so it also fills the per-user caches.
+            try: User._remember(User._from_page(item))
+            except (KeyError, IndexError, TypeError): pass
+        if data.get('has_more'): query['start_cursor'] = data.get('next_cursor')
+        else: break
     return users
+def _notion_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+def _location_row(item):
+    props = item['properties']
+    def text(name):
+        prop = props.get(name)
+        return prop['rich_text'][0]['text']['content'] if prop and prop.get('rich_text') else None
+    relation = props.get('User', {}).get('relation', [])
+    return {'notion_page_id': item['id'], 'user_page_id': relation[0]['id'] if relation else None, 'timestamp': normalize_timestamp(props['Timestamp']['date']['start']), 'latitude': props['Latitude'].get('number'), 'longitude': props['Longitude'].get('number'), 'ip_address': text('IPAddress'), 'battery': text('Battery'), 'device_info': text('DeviceInfo')}
+def _location_page(row):
+    now = datetime.utcnow()
+    log_id = f"{row['user_page_id'].split('-')[0]}-{int(now.timestamp())}"
+    properties_payload = {"LogID": { "title": [{"text": {"content": log_id}}] }, "User": { "relation": [{"id": row['user_page_id']}] }, "Timestamp": { "date": {"start": row['timestamp']} }, "Latitude": { "number": row['latitude'] }, "Longitude": { "number": row['longitude'] }, "IPAddress": { "rich_text": [{"text": {"content": str(row['ip_address'])}}] }, "Battery": { "rich_text": [{"text": {"content": str(row['battery'])}}] }, "DeviceInfo": { "rich_text": [{"text": {"content": str(row['device_info'])}}] }}
+    return {"parent": {"database_id": LOCATIONS_DB_ID}, "properties": properties_payload}
+
+class NotionLocationStore(LocationStore):
+    """Locations kept in the Notion Locations DB (the default backend)."""
+    def write(self, rows):
+        results = []
+        for response in notion.gather([('POST', "pages", _location_page(row)) for row in rows]):
+            # Only failures Notion certainly did not act on are worth retrying; after a 5xx or a
+            # read timeout the page may already exist, and sending it again would duplicate it.
+            if isinstance(response, Exception): logger.error(f"NOTION API ERROR (write locations): {response}"); results.append(None if never_sent(response) else False); continue
+            if response.status_code == 200: results.append(response.json()['id']); continue
+            logger.error(f"NOTION API ERROR (write locations): {response.status_code} {response.text}")
+            results.append(None if response.status_code == 429 else False)
+        return results
+    def latest_positions(self, user_page_ids=None):
+        """Pages through the Locations DB once, newest first, stopping as soon as every id in
+        `user_page_ids` has been seen; users still missing after LATEST_INDEX_REBUILD_PAGES
+        pages are looked up individually, concurrently."""
+        path = f"databases/{LOCATIONS_DB_ID}/query"
+        query = {"sorts": [{"property": "Timestamp", "direction": "descending"}], "page_size": 100}
+        pending = set(user_page_ids) if user_page_ids is not None else None
+        # Refreshes pick up rows Notion created after this, minus a margin for clock skew.
+        watermark = _notion_time(datetime.utcnow() - timedelta(seconds=LATEST_INDEX_WATERMARK_LAG))
+        positions = {}; pages = 0
+        while True:
+            response = notion.post(path, json=query)
+            if response.status_code != 200: logger.error(f"NOTION API ERROR (latest_positions): {response.json()}"); return None
+            data = response.json()
+            for item in data.get('results', []):
+                row = _location_row(item)
+                if row['user_page_id'] and row['user_page_id'] not in positions:
+                    positions[row['user_page_id']] = row
+                    if pending is not None: pending.discard(row['user_page_id'])
+            pages += 1
+            if pending is not None and not pending: break
+            if not data.get('has_more'): pending = None; break
+            if pending is not None and pages >= LATEST_INDEX_REBUILD_PAGES: break
+            query['start_cursor'] = data.get('next_cursor')
+        if pending:
+            pending = list(pending)
+            calls = [('POST', path, {"filter": {"property": "User", "relation": {"contains": page_id}}, "sorts": [{"property": "Timestamp", "direction": "descending"}], "page_size": 1}) for page_id in pending]
+            for page_id, response in zip(pending, notion.gather(calls)):
+                if isinstance(response, Exception) or response.status_code != 200: continue
+                results = response.json().get('results')
+                if results: positions[page_id] = _location_row(results[0])
+        return positions, watermark
+    def rows_since(self, watermark):
+        """Rows by when Notion created them rather than by Timestamp, so pings that arrive late
+        with older device times (offline batches, retried queue writes) are still picked up. The
+        watermark is a created_time, which Notion rounds to the minute, so each refresh reads
+        the last minute again."""
+        query = {"sorts": [{"timestamp": "created_time", "direction": "ascending"}], "page_size": 100}
+        if watermark: query["filter"] = {"timestamp": "created_time", "created_time": {"on_or_after": watermark}}
+        rows = []
+        try:
+            for data in notion.query_pages(LOCATIONS_DB_ID, query):
+                for item in data.get('results', []):
+                    rows.append(_location_row(item))
+                    if watermark is None or item['created_time'] > watermark: watermark = item['created_time']
+        except NotionError as exc:
+            logger.error(f"NOTION API ERROR (rows_since): {exc}"); return None
+        return rows, watermark
+    @instrument('NotionLocationStore.iter_all_rows')
+    def iter_all_rows(self, edited_since=None):
+        """Yields every row (with its `last_edited_time`) created or edited on or after `edited_since`,
+        least recently edited first. Raises NotionError if a page fails."""
+        query = {"sorts": [{"timestamp": "last_edited_time", "direction": "ascending"}], "page_size": 100}
+        if edited_since: query["filter"] = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": edited_since}}
+        for data in notion.query_pages(LOCATIONS_DB_ID, query):
+            for item in data.get('results', []): yield dict(_location_row(item), last_edited_time=item['last_edited_time'])
+    def history(self, user_page_id, limit=10):
+        path = f"databases/{LOCATIONS_DB_ID}/query"
+        query = {"filter": {"property": "User", "relation": {"contains": user_page_id}}, "sorts": [{"property": "Timestamp", "direction": "descending"}], "page_size": limit}
+        response = notion.post(path, json=query)
+        if response.status_code != 200: logger.error(f"NOTION API ERROR (get_user_location_history): {response.json()}"); return []
+        return [_location_row(item) for item in response.json().get('results', [])]
+    def query_range(self, user_page_id, start=None, end=None, cursor=None, limit=100, descending=True):
+        """One page of at most 100 rows (Notion's page size limit); the cursor is Notion's own."""
+        conditions = [{"property": "User", "relation": {"contains": user_page_id}}]
+        if start: conditions.append({"property": "Timestamp", "date": {"on_or_after": start}})
+        if end: conditions.append({"property": "Timestamp", "date": {"on_or_before": end}})
+        query = {"filter": {"and": conditions}, "sorts": [{"property": "Timestamp", "direction": "descending" if descending else "ascending"}], "page_size": min(limit, 100)}
+        if cursor: query['start_cursor'] = cursor
+        response = notion.query(LOCATIONS_DB_ID, query)
+        if response.status_code != 200: logger.error(f"NOTION API ERROR (query_range): {response.json()}"); return [], None
+        data = response.json()
+        return [_location_row(item) for item in data.get('results', [])], data.get('next_cursor') if data.get('has_more') else None
+    def iter_rows(self, user_page_id):
+        """Yields the user's rows newest first, fetching the next Notion page only when the previous one is used up."""
+        path = f"databases/{LOCATIONS_DB_ID}/query"
+        query = {"filter": {"property": "User", "relation": {"contains": user_page_id}}, "sorts": [{"property": "Timestamp", "direction": "descending"}], "page_size": 100}
+        while True:
+            response = notion.post(path, json=query)
+            if response.status_code != 200: logger.error(f"NOTION API ERROR (iter_user_logs_for_export): {response.json()}"); return
+            data = response.json()
+            for item in data.get('results', []): yield _location_row(item)
+            if data.get('has_more'): query['start_cursor'] = data.get('next_cursor')
+            else: return
+
+def _build_location_store():
+    if LOCATION_STORAGE == 'sqlite': return SQLiteLocationStore(LOCATION_DB_PATH)
+    if LOCATION_STORAGE == 'mirror': return MirroredLocationStore(NotionLocationStore(), SQLiteLocationStore(LOCATION_DB_PATH), MIRROR_SYNC_SECONDS, MIRROR_RECONCILE_SECONDS)
+    return NotionLocationStore()
+location_store = _build_location_store()
+
+@instrument('rebuild_latest_location_index')
+def rebuild_latest_location_index(user_page_ids=None):
+    """Rebuilds the latest-position index from the location store in one pass."""
+    result = location_store.latest_positions(user_page_ids)
+    if result is None: return False
+    positions, watermark = result
+    latest_location_index.replace({user_page_id: position_of(row) for user_page_id, row in positions.items()}, watermark)
+    return True
+@instrument('refresh_latest_location_index')
+def refresh_latest_location_index():
+    """Folds in pings stored since the index watermark, e.g. ones written by other workers."""
+    result = location_store.rows_since(latest_location_index.watermark)
+    if result is None: return False
+    rows, watermark = result
+    for row in rows:
+        if row['user_page_id']: latest_location_index.update(row['user_page_id'], position_of(row))
+    latest_location_index.mark_refreshed(watermark)
+    return True
+@instrument('get_all_users_latest_location')
 def get_all_users_latest_location():
     all_users = get_all_users()
+    if not latest_location_index.built:
+        with latest_location_index.refresh_lock:
+            if not latest_location_index.built: rebuild_latest_location_index([user['page_id'] for user in all_users])
+    elif latest_location_index.is_stale(LATEST_INDEX_MAX_AGE) and latest_location_index.refresh_lock.acquire(blocking=False):
+        # Requests arriving while another one refreshes serve the current index instead of waiting.
+        try: refresh_latest_location_index()
+        finally: latest_location_index.refresh_lock.release()
     latest_locations = []
     for user in all_users:
-        url = f"https://api.notion.com/v1/databases/{LOCATIONS_DB_ID}/query"
-        query = {"filter": {"property": "User", "relation": {"contains": user['page_id']}}, "sorts": [{"property": "Timestamp", "direction": "descending"}], "page_size": 1}
-        response = requests.post(url, json=query, headers=HEADERS)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('results'):
-                props = data['results'][0]['properties']
-                latest_locations.append({'username': user['username'], 'latitude': props['Latitude'].get('number'), 'longitude': props['Longitude'].get('number'), 'timestamp': props['Timestamp']['date']['start'], 'battery': props.get('Battery', {}).get('rich_text', [{}])[0].get('text', {}).get('content', 'N/A')})
+        position = latest_location_index.get(user['page_id'])
+        if position: latest_locations.append({'username': user['username'], **position})
     return latest_locations
+@instrument('get_user_location_history')
 def get_user_location_history(user_page_id, limit=10):
-    url = f"https://api.notion.com/v1/databases/{LOCATIONS_DB_ID}/query"
-    query = {"filter": {"property": "User", "relation": {"contains": user_page_id}}, "sorts": [{"property": "Timestamp", "direction": "descending"}], "page_size": limit}
-    response = requests.post(url, json=query, headers=HEADERS)
-    if response.status_code != 200: print(f"NOTION API ERROR (get_user_location_history): {response.json()}"); return []
-    data = response.json(); history = []
-    if 'results' in data:
-        for item in data['results']:
-            props = item['properties']
-            history.append({'timestamp': props['Timestamp']['date']['start'], 'latitude': props['Latitude'].get('number'), 'longitude': props['Longitude'].get('number'), 'ip_address': props['IPAddress']['rich_text'][0]['text']['content'] if props['IPAddress']['rich_text'] else 'N/A', 'battery': props['Battery']['rich_text'][0]['text']['content'] if props['Battery']['rich_text'] else 'N/A'})
-    return history
-def get_user_logs_for_export(user_page_id):
-    all_logs = []
-    url = f"https://api.notion.com/v1/databases/{LOCATIONS_DB_ID}/query"
-    query = {"filter": {"property": "User", "relation": {"contains": user_page_id}}, "sorts": [{"property": "Timestamp", "direction": "descending"}]}
+    return [history_of(row) for row in location_store.history(user_page_id, limit)]
+@instrument('query_location_history')
+def query_location_history(user_page_id, start=None, end=None, cursor=None, limit=100, max_points=None, descending=True, method='dp'):
+    """Location history between `start` and `end` (normalized timestamps, either optional).
+    Without `max_points` returns one page of `limit` rows plus the cursor for the next page.
+    With it, reads the whole range (up to HISTORY_MAX_ROWS rows, newest first, so a truncated
+    range loses its oldest rows) and simplifies the track to at most `max_points` points with
+    Douglas-Peucker ('dp') or time-bucket decimation ('bucket')."""
+    if not max_points:
+        rows, next_cursor = location_store.query_range(user_page_id, start, end, cursor, limit, descending)
+        return {'points': [history_of(row) for row in rows], 'next_cursor': next_cursor}
+    rows, truncated = _range_rows(user_page_id, start, end, HISTORY_MAX_ROWS, descending=True)
+    points = [history_of(row) for row in reversed(rows)]
+    simplified = time_bucket_decimate(points, max_points) if method == 'bucket' else douglas_peucker(points, max_points)
+    if descending: simplified.reverse()
+    return {'points': simplified, 'next_cursor': None, 'total_points': len(points), 'truncated': truncated}
+def _range_rows(user_page_id, start, end, max_rows, descending=False):
+    """Reads up to `max_rows` rows of the range, oldest first (newest first if `descending`).
+    Returns (rows, truncated)."""
+    rows = []; cursor = None
+    while len(rows) < max_rows:
+        page, cursor = location_store.query_range(user_page_id, start, end, cursor, min(1000, max_rows - len(rows)), descending=descending)
+        rows.extend(page)
+        if not cursor: break
+    return rows, cursor is not None
+@instrument('get_user_track')
+def get_user_track(user_page_id, start=None, end=None):
+    """The user's track between `start` and `end` (normalized timestamps; `start` defaults to
+    ANALYTICS_DEFAULT_DAYS ago). Only that window is read, newest rows first and at most
+    ANALYTICS_MAX_ROWS of them. The track stays cached for ANALYTICS_CACHE_TTL seconds, and a
+    later request inside the window it covers only reads rows newer than its last one."""
+    if start is None: start = normalize_timestamp((datetime.utcnow() - timedelta(days=ANALYTICS_DEFAULT_DAYS)).isoformat() + "Z")
+    # One lock per user, so a slow load only holds up requests for the same user.
+    with _track_lock: lock = _track_locks.setdefault(user_page_id, threading.Lock())
+    with lock:
+        cached = track_cache.get(user_page_id)
+        if cached is not None and cached[1] <= start and (cached[2] is None or (end is not None and end <= cached[2])):
+            track = cached[0]
+            if cached[2] is None:
+                last = track.last_timestamp or start
+                rows, truncated = _range_rows(user_page_id, last, None, ANALYTICS_MAX_ROWS)
+                track.extend(row for row in rows if row['timestamp'] > last)
+                track.truncated = track.truncated or truncated
+        else:
+            rows, truncated = _range_rows(user_page_id, start, end, ANALYTICS_MAX_ROWS, descending=True)
+            track = Track().extend(rows); track.truncated = truncated
+            track_cache.set(user_page_id, (track, start, end))
+        return track.between(epoch(start), epoch(end) if end else None)
+@instrument('get_user_analytics')
+def get_user_analytics(user_page_id, start=None, end=None, stop_radius_m=50.0, stop_seconds=300):
+    """Distance, speed, stops, per-geofence dwell time and battery for the user's track between
+    `start` and `end` (see get_user_track)."""
+    return get_user_track(user_page_id, start, end).summary(get_geofence_set(), stop_radius_m, stop_seconds)
+@instrument('iter_user_logs_for_export')
+def iter_user_logs_for_export(user_page_id):
+    """Yields a user's export rows newest first, straight from the location store."""
+    for row in location_store.iter_rows(user_page_id): yield export_of(row)
+@instrument('log_location')
+def log_location(user_page_id, latitude, longitude, ip_address, battery, device_info, timestamp=None):
+    return bool(log_locations([{'user_page_id': user_page_id, 'latitude': latitude, 'longitude': longitude, 'ip_address': ip_address, 'battery': battery, 'device_info': device_info, 'timestamp': timestamp}])[0])
+@instrument('log_locations')
+def log_locations(pings):
+    """Writes many pings (dicts of log_location's keyword arguments) in one batched store call.
+    Returns one result per ping: truthy when written, None when the store certainly did not
+    write it (rate limit, no connection) and the ping is worth retrying, False when it was
+    rejected or may have been written anyway (5xx, read timeout), so it must not be resent."""
+    now = datetime.utcnow().isoformat() + "Z"
+    rows = [{**ping, 'timestamp': normalize_timestamp(ping.get('timestamp') or now), 'latitude': float(ping['latitude']) if ping.get('latitude') is not None else 0, 'longitude': float(ping['longitude']) if ping.get('longitude') is not None else 0} for ping in pings]
+    results = location_store.write(rows)
+    for row, result in zip(rows, results):
+        if result: latest_location_index.update(row['user_page_id'], position_of(row))
+    return results
+@instrument('fetch_geofences')
+def fetch_geofences():
+    """Reads every zone from the Geofences DB. Returns None if Notion could not be queried."""
+    if not GEOFENCES_DB_ID: return []
+    path = f"databases/{GEOFENCES_DB_ID}/query"
+    query = {"page_size": 100}; zones = []
     while True:
-        response = requests.post(url, json=query, headers=HEADERS)
-        if response.status_code != 200: break
+        response = notion.post(path, json=query)
+        if response.status_code != 200: logger.error(f"NOTION API ERROR (fetch_geofences): {response.json()}"); return None
         data = response.json()
-        all_logs.extend(data.get('results', []))
+        for item in data.get('results', []):
+            props = item['properties']
+            zones.append({'name': props['Name']['title'][0]['text']['content'], 'lat': props['Latitude'].get('number'), 'lon': props['Longitude'].get('number'), 'radius': props['Radius'].get('number')})
         if data.get('has_more'): query['start_cursor'] = data.get('next_cursor')
         else: break
-    formatted_logs = []
-    for item in all_logs:
-        props = item['properties']
-        device_info_prop = props.get('DeviceInfo')
-        device_info_text = 'N/A'
-        if device_info_prop and device_info_prop.get('rich_text'):
-            device_info_text = device_info_prop['rich_text'][0]['text']['content']
-        formatted_logs.append({'Timestamp': props['Timestamp']['date']['start'], 'Latitude': props['Latitude'].get('number'), 'Longitude': props['Longitude'].get('number'), 'IPAddress': props['IPAddress']['rich_text'][0]['text']['content'] if props['IPAddress']['rich_text'] else 'N/A', 'Battery': props['Battery']['rich_text'][0]['text']['content'] if props['Battery']['rich_text'] else 'N/A', 'DeviceInfo': device_info_text})
-    return formatted_logs
-def log_location(user_page_id, latitude, longitude, ip_address, battery, device_info):
-    url = "https://api.notion.com/v1/pages"
-    timestamp = datetime.utcnow().isoformat() + "Z"
-    log_id = f"{user_page_id.split('-')[0]}-{int(datetime.utcnow().timestamp())}"
-    properties_payload = {"LogID": { "title": [{"text": {"content": log_id}}] }, "User": { "relation": [{"id": user_page_id}] }, "Timestamp": { "date": {"start": timestamp} }, "Latitude": { "number": float(latitude) if latitude is not None else 0 }, "Longitude": { "number": float(longitude) if longitude is not None else 0 }, "IPAddress": { "rich_text": [{"text": {"content": str(ip_address)}}] }, "Battery": { "rich_text": [{"text": {"content": str(battery)}}] }, "DeviceInfo": { "rich_text": [{"text": {"content": str(device_info)}}] }}
-    new_page_data = {"parent": {"database_id": LOCATIONS_DB_ID}, "properties": properties_payload}
-    response = requests.post(url, json=new_page_data, headers=HEADERS)
-    if response.status_code != 200: print(f"NOTION API ERROR (log_location): {response.json()}"); return False
-    return True
-def get_geofences():
-    if not GEOFENCES_DB_ID: return []
-    url = f"https://api.notion.com/v1/databases/{GEOFENCES_DB_ID}/query"
-    response = requests.post(url, headers=HEADERS)
-    if response.status_code != 200: return []
-    data = response.json()
-    zones = []
-    for item in data.get('results', []):
-        props = item['properties']
-        zones.append({'name': props['Name']['title'][0]['text']['content'], 'lat': props['Latitude'].get('number'), 'lon': props['Longitude'].get('number'), 'radius': props['Radius'].get('number')})
     return zones
+def get_geofence_set(refresh=False):
+    """Returns the compiled GeofenceSet, recompiling it from Notion at most every GEOFENCE_TTL seconds.
+    A failed refresh keeps serving the previous set."""
+    global _geofence_set, _geofence_expires
+    if not refresh and _geofence_set is not None and time.monotonic() < _geofence_expires: return _geofence_set
+    with _geofence_lock:
+        if not refresh and _geofence_set is not None and time.monotonic() < _geofence_expires: return _geofence_set
+        zones = fetch_geofences()
+        if zones is not None: _geofence_set = GeofenceSet(zones, cell_deg=GEOFENCE_CELL_DEG)
+        elif _geofence_set is None: return GeofenceSet([])
+        _geofence_expires = time.monotonic() + GEOFENCE_TTL
+        return _geofence_set
+def warm_caches():
+    """Loads the users, the sign-up setting and the geofences so the first requests after a cold
+    start find them cached. One at a time, users first: a parallel burst would spend the rate
+    limiter's tokens that those first requests may still need."""
+    started = time.perf_counter()
+    # The mirror's first sync also starts here rather than on the first read.
+    if isinstance(location_store, MirroredLocationStore): location_store.start_sync()
+    for name, load in (('users', get_all_users), ('settings', is_signup_enabled), ('geofences', get_geofence_set)):
+        try: load()
+        except Exception: logger.exception(f"WARMUP ERROR ({name})")
+    logger.info(f"Caches warmed in {time.perf_counter() - started:.2f}s")
+@instrument('get_geofences')
+def get_geofences():
+    return get_geofence_set().zones
+@instrument('check_geofence')
 def check_geofence(lat, lon):
-    zones = get_geofences()
-    for zone in zones:
-        R = 6371e3
-        phi1 = math.radians(lat); phi2 = math.radians(zone['lat'])
-        delta_phi = math.radians(zone['lat'] - lat); delta_lambda = math.radians(zone['lon'] - lon)
-        a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        distance = R * c
-        if distance <= zone['radius']: return f"is inside the '{zone['name']}' zone."
-    return None
+    """Returns every geofence zone containing the point."""
+    return get_geofence_set().matches(lat, lon)
+@instrument('check_geofences')
+def check_geofences(points):
+    """Batch form of check_geofence for a list of (lat, lon) pairs."""
+    return get_geofence_set().matches_many(points)
+@instrument('create_user')
 def create_user(username, password_hash):
-    if User.get_by_username(username): return None
-    url = "https://api.notion.com/v1/pages"
+    """Creates a 'User' account and returns it, built from Notion's reply rather than read back.
+    Callers check that the username is free first."""
+    path = "pages"
     user_id = f"user-{uuid.uuid4().hex[:6]}"
     new_user_data = {"parent": { "database_id": USERS_DB_ID }, "properties": {"UserID": { "title": [{ "text": { "content": user_id }}]}, "Username": { "rich_text": [{ "text": { "content": username }}]}, "PasswordHash": { "rich_text": [{ "text": { "content": password_hash }}]}, "Role": { "select": { "name": "User" }}}}
-    response = requests.post(url, json=new_user_data, headers=HEADERS)
-    if response.status_code != 200: print(f"NOTION API ERROR (create_user): {response.json()}"); return None
-    return User.get_by_username(username)
\ No newline at end of file
+    # Not retried on 5xx or read timeouts (see NotionClient.request): a second POST could leave
+    # two accounts with this username. A failed attempt may still have made the page, so the
+    # user list is refreshed either way and a retried sign-up finds the name taken.
+    import requests
+    try:
+        response = notion.post(path, json=new_user_data)
+    except requests.RequestException as exc:
+        logger.error(f"NOTION API ERROR (create_user): {exc}"); app_cache.invalidate('users'); return None
+    if response.status_code != 200: logger.error(f"NOTION API ERROR (create_user): {response.status_code} {response.text}"); app_cache.invalidate('users'); return None
+    user = User._from_page(response.json())
+    User._remember(user)
+    app_cache.invalidate('users')
+    return user
\ No newline at end of file
@@ -0,0 +1,186 @@
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+NOTION_VERSION = "2022-06-28"
+DEFAULT_API_URL = "https://api.notion.com/v1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, at most `capacity` banked."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._updated:
+                    # Paused by a 429: nothing goes out before the resume time.
+                    wait = self._updated - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Holds every caller back until `seconds` from now (used on 429). Overlapping pauses
+        share the latest resume time instead of adding up, and the bucket restarts with at
+        most one token so callers resume at `rate` rather than in a burst."""
+        with self._lock:
+            self._tokens = min(self._tokens, 1)
+            self._updated = max(self._updated, time.monotonic() + seconds)
+
+
+class NotionClient:
+    """Shared Notion API client.
+
+    One pooled keep-alive session, a token bucket matching Notion's ~3 req/s
+    limit, Retry-After aware retries with jittered exponential backoff, and a
+    bounded worker pool for fanning out many calls at once via `gather`.
+    Methods return the final `requests.Response`, so callers keep checking
+    `status_code` exactly as they did with bare `requests.post`.
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_API_URL, rate_limit=3.0, max_workers=4, max_retries=4, timeout=30):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit)
+        self.max_workers = max_workers
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    # Imported here rather than at module level: requests (with urllib3 and its
+                    # TLS setup) costs tens of milliseconds of every cold start that may not need it.
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, self.max_workers * 2))
+                    session.mount('https://', adapter); session.mount('http://', adapter)
+                    session.headers.update({"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json", "Notion-Version": NOTION_VERSION})
+                    self._session = session
+        return self._session
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='notion')
+        return self._executor
+
+    def _backoff(self, attempt, response=None):
+        if response is not None and response.headers.get('Retry-After'):
+            try:
+                return float(response.headers['Retry-After'])
+            except ValueError:
+                pass
+        return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def request(self, method, path, json=None, idempotent=None):
+        """Sends one call, retrying transient failures. Page creation (`POST pages`) is not
+        idempotent: after a 5xx or a read timeout Notion may already have made the page, so
+        unless `idempotent` says otherwise it is only retried on a 429 or when the connection
+        was never made, and any other failure is returned (or raised) as it is."""
+        import requests
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        if idempotent is None: idempotent = not (method == 'POST' and path.strip('/') == 'pages')
+        for attempt in range(self.max_retries + 1):
+            metrics.observe_throttle(self.bucket.acquire())
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, json=json, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                metrics.observe_notion(method, 'error', time.perf_counter() - started)
+                if attempt == self.max_retries or not (idempotent or never_sent(exc)): raise
+                metrics.observe_retry('connection')
+                time.sleep(self._backoff(attempt))
+                continue
+            metrics.observe_notion(method, response.status_code, time.perf_counter() - started)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries or not (idempotent or response.status_code == 429):
+                return response
+            metrics.observe_retry(response.status_code)
+            delay = self._backoff(attempt, response)
+            if response.status_code == 429: self.bucket.pause(delay)
+            else: time.sleep(delay)
+        return response
+
+    def post(self, path, json=None): return self.request('POST', path, json)
+    def patch(self, path, json=None): return self.request('PATCH', path, json)
+
+    def query(self, database_id, query=None):
+        return self.post(f"databases/{database_id}/query", json=query)
+
+    def query_pages(self, database_id, query=None):
+        """Yields the JSON body of each result page, following `next_cursor`.
+        Raises `NotionError` if Notion answers with a non-200."""
+        query = dict(query or {})
+        while True:
+            response = self.query(database_id, query)
+            if response.status_code != 200: raise NotionError(response)
+            data = response.json()
+            yield data
+            if not data.get('has_more'): return
+            query['start_cursor'] = data.get('next_cursor')
+
+    def submit(self, method, path, json=None):
+        # Run in a copy of the caller's context so metrics keep the calling function's label.
+        return self.executor.submit(contextvars.copy_context().run, self.request, method, path, json)
+
+    def gather(self, calls):
+        """Runs `(method, path, json)` calls on the worker pool and returns the
+        responses (or raised exceptions) in input order."""
+        import requests
+        futures = [self.submit(method, path, json) for method, path, json in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except requests.RequestException as exc:
+                results.append(exc)
+        return results
+
+
+def never_sent(exc):
+    """True when a requests exception shows the call never reached Notion (the connection
+    could not be made), so even a non-idempotent call is safe to send again."""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(exc, requests.ConnectTimeout): return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(exc, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class NotionError(Exception):
+    def __init__(self, response):
+        self.response = response
+        try:
+            detail = response.json()
+        except ValueError:
+            detail = response.text
+        super().__init__(f"{response.status_code}: {detail}")
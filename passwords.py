@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+PASSWORD_HASH_POOL = os.getenv('PASSWORD_HASH_POOL', 'thread' if os.getenv('VERCEL') else 'process')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(PASSWORD_HASH_WORKERS * 8)))
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashes are already queued."""
+
+
+def _encode(password):
+    # bcrypt only ever used the first 72 bytes; newer releases reject longer input instead.
+    return password.encode('utf-8')[:72]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password_hash, password):
+    try:
+        return bcrypt.checkpw(_encode(password), password_hash.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+class PasswordHasher:
+    """Runs bcrypt off the request thread on a bounded worker pool.
+
+    Processes keep hashing from competing with request threads for the GIL;
+    where they can't be started (e.g. serverless sandboxes without shared
+    memory) it falls back to threads, which bcrypt also runs in parallel. At
+    most `max_pending` hashes wait at once; beyond that callers get
+    `PasswordHasherBusy` instead of queueing behind a login storm.
+    """
+
+    def __init__(self, mode='process', workers=2, max_pending=16, wait=5.0):
+        self.mode = mode
+        self.workers = workers
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.mode == 'process':
+                        try:
+                            # By now ingest, warmup and Notion pool threads are running; a forked
+                            # child would inherit any lock one of them holds, so start workers fresh.
+                            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+                        except (OSError, NotImplementedError, ImportError, ValueError):
+                            self.mode = 'thread'
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self.wait): raise PasswordHasherBusy()
+        try:
+            try:
+                return self.executor.submit(function, *args).result()
+            except BrokenProcessPool:
+                # A worker died (OOM, killed); start a fresh pool and try once more.
+                with self._lock: self._executor = None
+                return self.executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def check(self, password_hash, password):
+        if not password_hash or password is None: return False
+        return self._run(_check, password_hash, password)
+
+    def hash(self, password, rounds=BCRYPT_LOG_ROUNDS):
+        return self._run(_hash, password, rounds)
+
+
+hasher = PasswordHasher(PASSWORD_HASH_POOL, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
@@ -1,20 +1,38 @@
-from flask import Blueprint, render_template, jsonify, request, redirect, url_for, flash, Response, send_file
+from flask import Blueprint, render_template, stream_template, jsonify, request, redirect, url_for, flash, Response, send_file
 from flask_login import login_required, current_user
 from models import (
-    get_all_users, get_user_location_history, log_location,
-    get_all_users_latest_location, check_geofence, get_user_logs_for_export,
-    get_geofences, delete_user, is_signup_enabled, set_signup_status
+    get_all_users, get_user_location_history, query_location_history, log_location, log_locations,
+    get_all_users_latest_location, check_geofence, check_geofences, iter_user_logs_for_export,
+    get_geofences, delete_user, is_signup_enabled, set_signup_status, get_user_analytics
 )
 from decorators import admin_required
-import csv
+from ingest import INGEST_MODE, get_pipeline, drop_duplicates, remember
+from live_feed import LIVE_FEED_ENABLED, broadcaster
+from storage import normalize_timestamp
+from throttle import client_ip
+from datetime import datetime, timedelta
 import io
-from fpdf import FPDF
+import itertools
+import json
+import os
+import zlib
 
 main = Blueprint('main', __name__)
 
-class PDF(FPDF):
-    def header(self): self.set_font('Helvetica', 'B', 12); self.cell(0, 10, 'LocSent Location History', 0, 1, 'C')
-    def footer(self): self.set_y(-15); self.set_font('Helvetica', 'I', 8); self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+EXPORT_PDF_MAX_ROWS = int(os.getenv('EXPORT_PDF_MAX_ROWS', '5000'))
+BATCH_MAX_POINTS = int(os.getenv('BATCH_MAX_POINTS', '500'))
+
+_pdf_class = None
+def _pdf():
+    """The PDF class, built on first export: fpdf (and the fontTools it pulls in) is the heaviest import in the app."""
+    global _pdf_class
+    if _pdf_class is None:
+        from fpdf import FPDF
+        class PDF(FPDF):
+            def header(self): self.set_font('Helvetica', 'B', 12); self.cell(0, 10, 'LocSent Location History', 0, 1, 'C')
+            def footer(self): self.set_y(-15); self.set_font('Helvetica', 'I', 8); self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+        _pdf_class = PDF
+    return _pdf_class
 @main.route('/')
 def index():
     if current_user.is_authenticated:
@@ -23,20 +41,103 @@ def index():
     return render_template('login.html')
 @main.route('/user/dashboard')
 @login_required
-def user_dashboard(): return render_template('user_dashboard.html', user=current_user)
+def user_dashboard(): return render_template('user_dashboard.html', user=current_user, live_feed=LIVE_FEED_ENABLED)
 @main.route('/user/send_location', methods=['POST'])
 @login_required
 def send_location():
-    data = request.json
-    if request.headers.getlist("X-Forwarded-For"): ip_address = request.headers.getlist("X-Forwarded-For")[0]
-    else: ip_address = request.remote_addr
-    success = log_location(user_page_id=current_user.page_id, latitude=data.get('latitude'), longitude=data.get('longitude'), ip_address=ip_address, battery=data.get('battery'), device_info=data.get('deviceInfo'))
-    if success:
-        if data.get('latitude') and data.get('longitude'):
-            status = check_geofence(data.get('latitude'), data.get('longitude'))
-            if status: flash(f"GEOFENCE ALERT: User '{current_user.username}' {status}", 'warning')
-        return jsonify({'status': 'success', 'message': 'Location logged successfully!'})
-    else: return jsonify({'status': 'error', 'message': 'Failed to log location. Check server logs.'}), 500
+    data = request.get_json(silent=True) or {}
+    try:
+        latitude = float(data['latitude']); longitude = float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Latitude and longitude are required.'}), 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({'status': 'error', 'message': 'Coordinates are out of range.'}), 400
+    ping = {'user_page_id': current_user.page_id, 'latitude': latitude, 'longitude': longitude, 'ip_address': client_ip(), 'battery': data.get('battery'), 'device_info': data.get('deviceInfo'), 'timestamp': normalize_timestamp(datetime.utcnow().isoformat() + "Z")}
+    if INGEST_MODE == 'async': get_pipeline().enqueue(**ping)
+    elif not log_location(**ping):
+        return jsonify({'status': 'error', 'message': 'Failed to log location. Check server logs.'}), 500
+    position = {'latitude': latitude, 'longitude': longitude, 'timestamp': ping['timestamp'], 'battery': ping['battery'] or 'N/A'}
+    broadcaster.publish_position(current_user.page_id, current_user.username, position)
+    zones = check_geofence(latitude, longitude)
+    for zone in zones:
+        flash(f"GEOFENCE ALERT: User '{current_user.username}' is inside the '{zone['name']}' zone.", 'warning')
+    broadcaster.publish_zones(current_user.page_id, current_user.username, zones, position)
+    if INGEST_MODE == 'async': return jsonify({'status': 'success', 'message': 'Location received!'}), 202
+    return jsonify({'status': 'success', 'message': 'Location logged successfully!'})
+def _point_timestamp(value, now):
+    """Device timestamps are ISO 8601 strings or epoch milliseconds; missing means 'now'."""
+    if value is None or value == '': return normalize_timestamp(now.isoformat() + "Z")
+    if isinstance(value, (int, float)) and not isinstance(value, bool): parsed = datetime.utcfromtimestamp(value / 1000)
+    else:
+        timestamp = normalize_timestamp(str(value))
+        if not timestamp.endswith('Z'): raise ValueError(value)
+        parsed = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+    if parsed > now + timedelta(minutes=5): raise ValueError(value)
+    return normalize_timestamp(parsed.isoformat() + "Z")
+def _is_number(value): return isinstance(value, (int, float)) and not isinstance(value, bool)
+def _decode_points(data):
+    """Expands a batch body into point dicts. `points` is either a list of objects like
+    send_location's body plus `timestamp`, or with "encoding": "delta" a list of
+    [t, lat, lon] rows where the first row is absolute (epoch ms, degrees x `scale`)
+    and each later row holds the differences from the row before it."""
+    if isinstance(data, list): data = {'points': data}
+    if not isinstance(data, dict) or not isinstance(data.get('points'), list): raise ValueError("Expected a list of points.")
+    if data.get('encoding', 'json') == 'json': return data['points']
+    if data['encoding'] != 'delta': raise ValueError(f"Unknown encoding: {data['encoding']}")
+    # Every input is checked here, so the 400 a client gets never carries a raw Python error.
+    scale = data.get('scale', 1e6); points = []; t = lat = lon = 0
+    if not _is_number(scale) or not 0 < scale < float('inf'): raise ValueError("scale must be a positive number.")
+    for row in data['points']:
+        if not isinstance(row, list) or len(row) != 3 or not all(_is_number(value) for value in row): raise ValueError("Delta rows must be [t, lat, lon] numbers.")
+        t += row[0]; lat += row[1]; lon += row[2]
+        points.append({'timestamp': t, 'latitude': lat / scale, 'longitude': lon / scale})
+    return points
+@main.route('/user/send_locations', methods=['POST'])
+@login_required
+def send_locations():
+    """Accepts a batch of pings buffered on the device (see _decode_points). Top-level
+    `battery` and `deviceInfo` apply to points without their own. Points are keyed by their
+    device timestamp, so re-sending a batch never logs a point twice."""
+    data = request.get_json(silent=True)
+    try:
+        points = _decode_points(data)
+    except ValueError as exc:
+        return jsonify({'status': 'error', 'message': str(exc)}), 400
+    if len(points) > BATCH_MAX_POINTS:
+        return jsonify({'status': 'error', 'message': f'At most {BATCH_MAX_POINTS} points per batch.'}), 413
+    defaults = data if isinstance(data, dict) else {}
+    now = datetime.utcnow(); ip_address = client_ip(); pings = []; rejected = 0
+    for point in points:
+        try:
+            latitude = float(point['latitude']); longitude = float(point['longitude'])
+            timestamp = _point_timestamp(point.get('timestamp'), now)
+        except (KeyError, TypeError, ValueError, OverflowError, OSError):
+            rejected += 1; continue
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180): rejected += 1; continue
+        pings.append({'user_page_id': current_user.page_id, 'latitude': latitude, 'longitude': longitude, 'ip_address': ip_address, 'battery': point.get('battery', defaults.get('battery')), 'device_info': point.get('deviceInfo', defaults.get('deviceInfo')), 'timestamp': timestamp})
+    fresh = drop_duplicates(pings); duplicates = len(pings) - len(fresh)
+    if INGEST_MODE == 'async':
+        if fresh: get_pipeline().enqueue_many(fresh); remember(fresh)
+        accepted = fresh
+    else:
+        results = log_locations(fresh) if fresh else []
+        accepted = [ping for ping, result in zip(fresh, results) if result]; remember(accepted)
+        rejected += sum(result is False for result in results)
+        if any(result is None for result in results):
+            return jsonify({'status': 'error', 'message': 'Some locations could not be logged; send the batch again.', 'accepted': len(accepted), 'duplicates': duplicates, 'rejected': rejected}), 503
+    if accepted: _publish_batch(sorted(accepted, key=lambda ping: ping['timestamp']))
+    summary = {'accepted': len(accepted), 'duplicates': duplicates, 'rejected': rejected}
+    return jsonify({'status': 'success', 'message': f"{len(accepted)} location(s) received.", **summary}), 202 if INGEST_MODE == 'async' else 200
+def _publish_batch(pings):
+    """Replays a time-ordered batch through the live feed: zone entries for every point,
+    the position (and dashboard alerts) for the newest one only."""
+    positions = [{'latitude': ping['latitude'], 'longitude': ping['longitude'], 'timestamp': ping['timestamp'], 'battery': ping['battery'] or 'N/A'} for ping in pings]
+    matches = check_geofences([(ping['latitude'], ping['longitude']) for ping in pings])
+    for zones, position in zip(matches, positions):
+        broadcaster.publish_zones(current_user.page_id, current_user.username, zones, position)
+    broadcaster.publish_position(current_user.page_id, current_user.username, positions[-1])
+    for zone in matches[-1]:
+        flash(f"GEOFENCE ALERT: User '{current_user.username}' is inside the '{zone['name']}' zone.", 'warning')
 
 @main.route('/admin/dashboard')
 @login_required
@@ -44,7 +145,7 @@ def send_location():
 def admin_dashboard():
     users = get_all_users()
     signup_status = is_signup_enabled()
-    return render_template('admin_dashboard.html', users=users, signup_enabled=signup_status)
+    return render_template('admin_dashboard.html', users=users, signup_enabled=signup_status, live_feed=LIVE_FEED_ENABLED)
 
 @main.route('/admin/delete_user/<user_page_id>', methods=['POST'])
 @login_required
@@ -52,6 +153,7 @@ def admin_dashboard():
 def delete_user_route(user_page_id):
     success = delete_user(user_page_id)
     if success:
+        broadcaster.forget(user_page_id)
         flash('User successfully deleted.', 'success')
     else:
         flash('Error: Could not delete user.', 'danger')
@@ -75,38 +177,113 @@ def toggle_signup():
 @login_required
 @admin_required
 def get_all_latest_locations(): return jsonify(get_all_users_latest_location())
+def _event_stream(subscribe):
+    # 204 tells EventSource to stop reconnecting.
+    if not LIVE_FEED_ENABLED: return Response(status=204)
+    subscriber = subscribe()
+    return Response(broadcaster.stream(subscriber), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+@main.route('/admin/api/live')
+@login_required
+@admin_required
+def admin_live_feed(): return _event_stream(broadcaster.subscribe)
+@main.route('/user/api/live')
+@login_required
+def user_live_feed(): return _event_stream(lambda: broadcaster.subscribe(current_user.page_id))
+@main.route('/admin/api/ingest_stats')
+@login_required
+@admin_required
+def ingest_stats(): return jsonify(get_pipeline().stats() if INGEST_MODE == 'async' else {'mode': INGEST_MODE})
 @main.route('/api/get_geofences')
 @login_required
 def get_geofences_api_user(): return jsonify(get_geofences())
+def _parse_time_arg(name):
+    value = request.args.get(name)
+    if not value: return None
+    try:
+        if value.replace('.', '', 1).isdigit(): parsed = datetime.utcfromtimestamp(float(value))
+        else: parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError(f"Invalid '{name}' timestamp: {value}") from None
+    return normalize_timestamp(parsed.isoformat())
 @main.route('/admin/get_location_history/<user_page_id>')
 @login_required
 @admin_required
-def get_location_history(user_page_id): return jsonify(get_user_location_history(user_page_id))
+def get_location_history(user_page_id):
+    """Without query arguments returns the last 10 entries as a list. With any of from/to
+    (ISO 8601 or epoch seconds), cursor, limit, max_points, order (asc|desc) or
+    simplify (dp|bucket) returns {'points': [...], 'next_cursor': ...}."""
+    if not request.args: return jsonify(get_user_location_history(user_page_id))
+    try:
+        start = _parse_time_arg('from'); end = _parse_time_arg('to')
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        max_points = int(request.args['max_points']) if request.args.get('max_points') else None
+        if max_points is not None and max_points < 2: raise ValueError("max_points must be at least 2.")
+        # The SQLite backends raise ValueError for a malformed cursor.
+        history = query_location_history(user_page_id, start, end, request.args.get('cursor'), limit, max_points, request.args.get('order', 'desc') != 'asc', request.args.get('simplify', 'dp'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(history)
+@main.route('/admin/api/analytics/<user_page_id>')
+@login_required
+@admin_required
+def user_analytics(user_page_id):
+    """Track summary between from/to (ISO 8601 or epoch seconds): distance, speeds, stops
+    (tunable with stop_radius in metres and stop_minutes), geofence dwell times and battery."""
+    try:
+        start = _parse_time_arg('from'); end = _parse_time_arg('to')
+        stop_radius = float(request.args.get('stop_radius', 50)); stop_minutes = float(request.args.get('stop_minutes', 5))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(get_user_analytics(user_page_id, start, end, stop_radius, stop_minutes * 60))
+def _csv_chunks(rows, fieldnames, rows_per_chunk=500):
+    import csv
+    buffer = io.StringIO(); writer = csv.DictWriter(buffer, fieldnames=fieldnames); writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0: yield buffer.getvalue(); buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue()
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data: yield data
+    yield compressor.flush()
+def _pdf_export(rows, fieldnames):
+    """Renders at most EXPORT_PDF_MAX_ROWS rows; FPDF keeps the whole document in memory until output()."""
+    pdf = _pdf()(orientation='L', unit='mm', format='A4'); pdf.add_page(); pdf.set_font("Helvetica", size=8); col_widths = {'Timestamp': 45, 'Latitude': 20, 'Longitude': 20, 'IPAddress': 25, 'Battery': 40, 'DeviceInfo': 120}; pdf.set_fill_color(200, 220, 255)
+    for col_name in fieldnames: pdf.cell(col_widths.get(col_name, 30), 7, col_name, 1, 0, 'C', 1)
+    pdf.ln(); pdf.set_fill_color(255, 255, 255)
+    for row in itertools.islice(rows, EXPORT_PDF_MAX_ROWS):
+        for col_name in fieldnames: pdf.cell(col_widths.get(col_name, 30), 6, str(row.get(col_name, '')), 1)
+        pdf.ln()
+    if next(rows, None) is not None:
+        pdf.ln(); pdf.cell(0, 6, f"Only the {EXPORT_PDF_MAX_ROWS} most recent entries are included. Export as CSV or NDJSON for the full history.", 0, 1)
+    return io.BytesIO(pdf.output())
 @main.route('/admin/export_logs/<user_page_id>/<username>/<export_format>')
 @login_required
 @admin_required
 def export_logs(user_page_id, username, export_format):
-    logs = get_user_logs_for_export(user_page_id)
-    if not logs:
+    if export_format not in ('csv', 'ndjson', 'html', 'pdf'):
+        flash(f"Invalid export format: {export_format}", "danger")
+        return redirect(url_for('main.admin_dashboard'))
+    rows = iter_user_logs_for_export(user_page_id)
+    first = next(rows, None)
+    if first is None:
         flash(f"No logs found for user {username} to export.", "info")
         return redirect(url_for('main.admin_dashboard'))
+    rows = itertools.chain([first], rows); fieldnames = list(first.keys())
     filename = f"{username}_location_history.{export_format}"
+    if export_format == 'pdf':
+        return send_file(_pdf_export(rows, fieldnames), as_attachment=True, download_name=filename, mimetype='application/pdf')
     if export_format == 'csv':
-        output = io.StringIO(); writer = csv.DictWriter(output, fieldnames=logs[0].keys()); writer.writeheader(); writer.writerows(logs)
-        return Response(output.getvalue(), mimetype="text/csv", headers={"Content-disposition": f"attachment; filename={filename}"})
-    elif export_format == 'html':
-        return Response(render_template('export_template.html', logs=logs, username=username), mimetype="text/html", headers={"Content-disposition": f"attachment; filename={filename}"})
-    elif export_format == 'pdf':
-        pdf = PDF(orientation='L', unit='mm', format='A4'); pdf.add_page(); pdf.set_font("Helvetica", size=8); header = list(logs[0].keys()); col_widths = {'Timestamp': 45, 'Latitude': 20, 'Longitude': 20, 'IPAddress': 25, 'Battery': 40, 'DeviceInfo': 120}; pdf.set_fill_color(200, 220, 255)
-        for col_name in header: pdf.cell(col_widths.get(col_name, 30), 7, col_name, 1, 0, 'C', 1)
-        pdf.ln(); pdf.set_fill_color(255, 255, 255)
-        for row in logs:
-            for col_name in header: pdf.cell(col_widths.get(col_name, 30), 6, str(row.get(col_name, '')), 1)
-            pdf.ln()
-        pdf_buffer = io.BytesIO(pdf.output()); pdf_buffer.seek(0)
-        return send_file(pdf_buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
-    flash(f"Invalid export format: {export_format}", "danger")
-    return redirect(url_for('main.admin_dashboard'))
+        chunks = _csv_chunks(rows, fieldnames); mimetype = "text/csv"
+    elif export_format == 'ndjson':
+        chunks = (json.dumps(row) + "\n" for row in rows); mimetype = "application/x-ndjson"
+    else:
+        chunks = stream_template('export_template.html', logs=rows, fieldnames=fieldnames, username=username); mimetype = "text/html"
+    if request.args.get('compress') == 'gzip':
+        chunks = _gzip_chunks(chunks); mimetype = "application/gzip"; filename += ".gz"
+    return Response(chunks, mimetype=mimetype, headers={"Content-disposition": f"attachment; filename={filename}"})
 
 @main.route('/api/get_active_users_count')
 @login_required
@@ -10,6 +10,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (document.getElementById('send-location-btn')) {
         setInterval(sendLocation, 3600000);
+        const flushQuietly = () => flushPendingPings().catch((error) => console.error("Could not send saved locations:", error.message));
+        window.addEventListener('online', flushQuietly);
+        if (loadPendingPings().length && navigator.onLine) flushQuietly();
     }
 
     if (document.getElementById('live-map')) {
@@ -49,27 +52,70 @@ function initializeUserMap() {
         attribution: '© OpenStreetMap contributors'
     }).addTo(userMap);
     drawGeofences(userMap);
-    updateUserMarker();
-    setInterval(updateUserMarker, 20000);
+    if (navigator.geolocation) {
+        navigator.geolocation.watchPosition(updateUserMarker, (error) => {
+            console.error("Could not get user location:", error.message);
+        }, { enableHighAccuracy: true, maximumAge: 20000 });
+    }
+    if (window.EventSource && document.getElementById('user-map').dataset.liveFeed === 'true') {
+        const feed = new EventSource('/user/api/live');
+        feed.addEventListener('geofence', (e) => {
+            const { zone } = JSON.parse(e.data);
+            const statusEl = document.getElementById('status-message');
+            if (statusEl) statusEl.textContent = `You are inside the '${zone}' zone.`;
+        });
+    }
 }
-function updateUserMarker() {
-    navigator.geolocation.getCurrentPosition(position => {
-        const { latitude, longitude } = position.coords;
-        const latLng = [latitude, longitude];
-        if (userMarker) {
-            userMarker.setLatLng(latLng);
-        } else {
-            userMarker = L.marker(latLng).addTo(userMap).bindPopup('<b>Your Location</b>').openPopup();
-            userMap.setView(latLng, 13);
+function updateUserMarker(position) {
+    const { latitude, longitude } = position.coords;
+    const latLng = [latitude, longitude];
+    if (userMarker) {
+        userMarker.setLatLng(latLng);
+    } else {
+        userMarker = L.marker(latLng).addTo(userMap).bindPopup('<b>Your Location</b>').openPopup();
+        userMap.setView(latLng, 13);
+    }
+}
+const PENDING_PINGS_KEY = 'locsent-pending-pings';
+const MAX_PENDING_PINGS = 1000;
+const PINGS_PER_BATCH = 200;
+function loadPendingPings() {
+    try {
+        return JSON.parse(localStorage.getItem(PENDING_PINGS_KEY)) || [];
+    } catch (e) {
+        return [];
+    }
+}
+function savePendingPings(pings) {
+    localStorage.setItem(PENDING_PINGS_KEY, JSON.stringify(pings.slice(-MAX_PENDING_PINGS)));
+}
+async function flushPendingPings() {
+    const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+    let data = null;
+    while (true) {
+        const batch = loadPendingPings().slice(0, PINGS_PER_BATCH);
+        if (!batch.length) return data;
+        const response = await fetch('/user/send_locations', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken
+            },
+            body: JSON.stringify({ points: batch, deviceInfo: navigator.userAgent })
+        });
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({ message: 'Request failed with status: ' + response.status }));
+            throw new Error(errorData.message || 'Failed to send location.');
         }
-    }, (error) => {
-        console.error("Could not get user location:", error.message);
-    }, { enableHighAccuracy: true });
+        data = await response.json();
+        // Pings queued while the request was in flight stay for the next batch.
+        const sent = new Set(batch.map(ping => ping.timestamp));
+        savePendingPings(loadPendingPings().filter(ping => !sent.has(ping.timestamp)));
+    }
 }
 async function sendLocation() {
     const statusEl = document.getElementById('status-message');
     const buttonEl = document.getElementById('send-location-btn');
-    const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
     if (!navigator.geolocation) {
         if (statusEl) statusEl.textContent = 'Geolocation is not supported.';
         return;
@@ -86,24 +132,17 @@ async function sendLocation() {
             const battery = await navigator.getBattery();
             batteryInfo = `Charging: ${battery.charging ? 'Yes' : 'No'}, Level: ${Math.round(battery.level * 100)}%`;
         }
-        const deviceInfo = navigator.userAgent;
-        if (statusEl) statusEl.textContent = 'Sending to admin...';
-        const response = await fetch('/user/send_location', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
-            },
-            body: JSON.stringify({ latitude, longitude, battery: batteryInfo, deviceInfo: deviceInfo })
-        });
-        if (!response.ok) {
-            const errorData = await response.json().catch(() => ({ message: 'Request failed with status: ' + response.status }));
-            throw new Error(errorData.message || 'Failed to send location.');
+        savePendingPings([...loadPendingPings(), { latitude, longitude, battery: batteryInfo, timestamp: position.timestamp }]);
+        if (!navigator.onLine) {
+            if (statusEl) statusEl.textContent = 'Offline: location saved and will be sent when you reconnect.';
+            return;
         }
-        const data = await response.json();
-        if (statusEl) statusEl.textContent = data.message;
+        if (statusEl) statusEl.textContent = 'Sending to admin...';
+        const data = await flushPendingPings();
+        if (statusEl) statusEl.textContent = data ? data.message : 'Location sent.';
     } catch (error) {
-        if (statusEl) statusEl.textContent = `Error: ${error.message}`;
+        const pending = loadPendingPings().length;
+        if (statusEl) statusEl.textContent = `Error: ${error.message}` + (pending ? ` (${pending} location(s) saved for retry)` : '');
     } finally {
         if (buttonEl) buttonEl.disabled = false;
         setTimeout(() => {
@@ -122,24 +161,41 @@ function initializeAdminMap() {
     }).addTo(adminMap);
     drawGeofences(adminMap);
     updateAdminMapMarkers();
+    // The snapshot poll runs even with the live feed, which only carries pings handled by the
+    // server process this stream is connected to.
     setInterval(updateAdminMapMarkers, 30000);
+    if (window.EventSource && document.getElementById('live-map').dataset.liveFeed === 'true') {
+        const feed = new EventSource('/admin/api/live');
+        let connectedBefore = false;
+        feed.addEventListener('open', () => {
+            // Re-sync after a reconnect, since deltas sent while disconnected are lost.
+            if (connectedBefore) updateAdminMapMarkers();
+            connectedBefore = true;
+        });
+        feed.addEventListener('position', (e) => setAdminMarker(JSON.parse(e.data)));
+        feed.addEventListener('geofence', (e) => {
+            const { username, zone } = JSON.parse(e.data);
+            if (userMarkers[username]) userMarkers[username].bindTooltip(`Inside ${zone}`).openTooltip();
+        });
+    }
+}
+function setAdminMarker(user) {
+    const { username, latitude, longitude, timestamp, battery } = user;
+    if (latitude && longitude) {
+        const popupContent = `<b>${username}</b><br>Updated: ${new Date(timestamp).toLocaleString()}<br>Battery: ${battery}`;
+        if (userMarkers[username]) {
+            userMarkers[username].setLatLng([latitude, longitude]).setPopupContent(popupContent);
+        } else {
+            userMarkers[username] = L.marker([latitude, longitude]).addTo(adminMap).bindPopup(popupContent);
+        }
+    }
 }
 async function updateAdminMapMarkers() {
     try {
         const response = await fetch('/admin/api/get_all_latest_locations');
         if (!response.ok) throw new Error('Failed to fetch locations');
         const locations = await response.json();
-        locations.forEach(user => {
-            const { username, latitude, longitude, timestamp, battery } = user;
-            if (latitude && longitude) {
-                const popupContent = `<b>${username}</b><br>Updated: ${new Date(timestamp).toLocaleString()}<br>Battery: ${battery}`;
-                if (userMarkers[username]) {
-                    userMarkers[username].setLatLng([latitude, longitude]).setPopupContent(popupContent);
-                } else {
-                    userMarkers[username] = L.marker([latitude, longitude]).addTo(adminMap).bindPopup(popupContent);
-                }
-            }
-        });
+        locations.forEach(setAdminMarker);
     } catch (error) {
         console.error("Admin Map Marker Update Error:", error);
     }
@@ -189,4 +245,23 @@ async function fetchLocationHistory(userPageId, username) {
     } catch (error) {
         contentDiv.innerHTML = `<p class="alert alert-danger">Error fetching data: ${error.message}</p>`;
     }
+    drawTrack(userPageId);
+}
+let trackLine;
+async function drawTrack(userPageId) {
+    if (!adminMap) return;
+    try {
+        const since = Math.floor(Date.now() / 1000) - 24 * 3600;
+        const response = await fetch(`/admin/get_location_history/${userPageId}?from=${since}&max_points=300&order=asc`);
+        if (!response.ok) throw new Error('Failed to fetch track');
+        const { points } = await response.json();
+        if (trackLine) adminMap.removeLayer(trackLine);
+        trackLine = null;
+        if (points.length > 1) {
+            trackLine = L.polyline(points.map(p => [p.latitude, p.longitude]), { color: '#4d79ff', weight: 3 }).addTo(adminMap);
+            adminMap.fitBounds(trackLine.getBounds(), { padding: [20, 20] });
+        }
+    } catch (error) {
+        console.error("Track Drawing Error:", error);
+    }
 }
\ No newline at end of file
@@ -0,0 +1,304 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+ROW_FIELDS = ('user_page_id', 'timestamp', 'latitude', 'longitude', 'ip_address', 'battery', 'device_info', 'notion_page_id')
+
+
+def normalize_timestamp(value):
+    """Returns `value` as a UTC 'YYYY-MM-DDTHH:MM:SS.ffffffZ' string so timestamps from
+    Notion, devices and datetime.utcnow() all sort correctly as plain strings."""
+    if not value: return value
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+    if parsed.tzinfo is not None: parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def position_of(row):
+    return {'latitude': row['latitude'], 'longitude': row['longitude'], 'timestamp': row['timestamp'], 'battery': row['battery'] or 'N/A'}
+
+
+def history_of(row):
+    return {'timestamp': row['timestamp'], 'latitude': row['latitude'], 'longitude': row['longitude'], 'ip_address': row['ip_address'] or 'N/A', 'battery': row['battery'] or 'N/A'}
+
+
+def export_of(row):
+    return {'Timestamp': row['timestamp'], 'Latitude': row['latitude'], 'Longitude': row['longitude'], 'IPAddress': row['ip_address'] or 'N/A', 'Battery': row['battery'] or 'N/A', 'DeviceInfo': row['device_info'] or 'N/A'}
+
+
+class LocationStore:
+    """Backend behind the location functions in models.py.
+
+    Rows are dicts keyed by ROW_FIELDS. `write` returns one result per row:
+    truthy when stored, None for a transient failure worth retrying, False
+    when the row was rejected.
+    """
+
+    def write(self, rows): raise NotImplementedError
+
+    def latest_positions(self, user_page_ids=None):
+        """Returns ({user_page_id: newest row}, watermark) or None on failure."""
+        raise NotImplementedError
+
+    def rows_since(self, watermark):
+        """Returns (rows stored since `watermark` was taken, new watermark) or None on failure.
+        Watermarks are opaque and backend-specific. Rows are picked by when they were stored,
+        not by their timestamp, since devices upload old pings late."""
+        raise NotImplementedError
+
+    def history(self, user_page_id, limit=10):
+        """Returns the user's newest `limit` rows, newest first."""
+        raise NotImplementedError
+
+    def iter_rows(self, user_page_id):
+        """Yields every row for the user, newest first."""
+        raise NotImplementedError
+
+    def query_range(self, user_page_id, start=None, end=None, cursor=None, limit=100, descending=True):
+        """Returns (rows, next_cursor) for one page of the user's rows with `start` <= timestamp <= `end`.
+        `next_cursor` is an opaque string, or None on the last page."""
+        raise NotImplementedError
+
+
+class SQLiteLocationStore(LocationStore):
+    """Locations kept in a local SQLite file (WAL mode) indexed on (user, timestamp)."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS locations (
+            id INTEGER PRIMARY KEY,
+            notion_page_id TEXT UNIQUE,
+            user_page_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            latitude REAL,
+            longitude REAL,
+            ip_address TEXT,
+            battery TEXT,
+            device_info TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_locations_user_timestamp ON locations (user_page_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_locations_timestamp ON locations (timestamp);
+        CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+    """
+    COLUMNS = "user_page_id, timestamp, latitude, longitude, ip_address, battery, device_info, notion_page_id"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connect()
+        connection.executescript(self.SCHEMA)
+        connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def write(self, rows):
+        values = [(row['user_page_id'], normalize_timestamp(row['timestamp']), row['latitude'], row['longitude'], row.get('ip_address'), row.get('battery'), row.get('device_info'), row.get('notion_page_id')) for row in rows]
+        try:
+            with self.connection as connection:
+                connection.executemany(f"INSERT OR IGNORE INTO locations ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+        except sqlite3.IntegrityError as exc:
+            logger.error(f"SQLITE ERROR (write): {exc}")
+            return [False] * len(rows)
+        except sqlite3.OperationalError as exc:
+            logger.error(f"SQLITE ERROR (write): {exc}")
+            return [None] * len(rows)
+        return [True] * len(rows)
+
+    def upsert(self, rows):
+        """Inserts rows, or updates the stored copy of ones whose notion_page_id is already present."""
+        values = [(row['user_page_id'], normalize_timestamp(row['timestamp']), row['latitude'], row['longitude'], row.get('ip_address'), row.get('battery'), row.get('device_info'), row['notion_page_id']) for row in rows]
+        with self.connection as connection:
+            connection.executemany(f"INSERT INTO locations ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (notion_page_id) DO UPDATE SET user_page_id = excluded.user_page_id, timestamp = excluded.timestamp, latitude = excluded.latitude, longitude = excluded.longitude, ip_address = excluded.ip_address, battery = excluded.battery, device_info = excluded.device_info", values)
+
+    def delete_missing(self, notion_page_ids, max_id):
+        """Deletes rows up to `max_id` whose Notion page isn't in `notion_page_ids`. Returns how many."""
+        with self.connection as connection:
+            connection.execute("CREATE TEMP TABLE IF NOT EXISTS seen_pages (notion_page_id TEXT PRIMARY KEY)")
+            connection.execute("DELETE FROM seen_pages")
+            connection.executemany("INSERT OR IGNORE INTO seen_pages VALUES (?)", ((page_id,) for page_id in notion_page_ids))
+            deleted = connection.execute("DELETE FROM locations WHERE id <= ? AND notion_page_id IS NOT NULL AND notion_page_id NOT IN (SELECT notion_page_id FROM seen_pages)", (max_id,)).rowcount
+            connection.execute("DELETE FROM seen_pages")
+        return deleted
+
+    def get_state(self, key):
+        row = self.connection.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        with self.connection as connection:
+            connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+    def acquire_lease(self, name, owner, seconds):
+        """Takes or renews the lease `name` for `owner` for `seconds`, unless another owner holds
+        it unexpired. One statement, so processes sharing the file can't both win. Returns True
+        when `owner` holds the lease."""
+        now = time.time()
+        with self.connection as connection:
+            connection.execute("INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires WHERE leases.owner = excluded.owner OR leases.expires < ?", (name, owner, now + seconds, now))
+        row = self.connection.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def latest_positions(self, user_page_ids=None):
+        # SQLite fills bare columns from the row holding MAX(timestamp).
+        cursor = self.connection.execute(f"SELECT {self.COLUMNS}, MAX(timestamp) AS newest FROM locations GROUP BY user_page_id")
+        positions = {row['user_page_id']: {field: row[field] for field in ROW_FIELDS} for row in cursor}
+        return positions, self.max_id()
+
+    def rows_since(self, watermark):
+        # The watermark is the largest row id seen; ids only grow, whatever the row's timestamp.
+        cursor = self.connection.execute(f"SELECT id, {self.COLUMNS} FROM locations WHERE id > ? ORDER BY id", (watermark or 0,))
+        rows = [dict(row) for row in cursor]
+        return [{field: row[field] for field in ROW_FIELDS} for row in rows], rows[-1]['id'] if rows else watermark
+
+    def history(self, user_page_id, limit=10):
+        cursor = self.connection.execute(f"SELECT {self.COLUMNS} FROM locations WHERE user_page_id = ? ORDER BY timestamp DESC LIMIT ?", (user_page_id, limit))
+        return [dict(row) for row in cursor]
+
+    def iter_rows(self, user_page_id):
+        # A private connection, since the generator may be drained after the request thread moved on.
+        connection = self._connect()
+        try:
+            cursor = connection.execute(f"SELECT {self.COLUMNS} FROM locations WHERE user_page_id = ? ORDER BY timestamp DESC", (user_page_id,))
+            while True:
+                batch = cursor.fetchmany(500)
+                if not batch: return
+                for row in batch: yield dict(row)
+        finally:
+            connection.close()
+
+    def query_range(self, user_page_id, start=None, end=None, cursor=None, limit=100, descending=True):
+        clauses = ["user_page_id = ?"]; params = [user_page_id]
+        if start: clauses.append("timestamp >= ?"); params.append(start)
+        if end: clauses.append("timestamp <= ?"); params.append(end)
+        if cursor:
+            # Keyset pagination on (timestamp, id), which stays fast however deep the page.
+            timestamp, _, row_id = cursor.rpartition('|')
+            if not (timestamp and row_id.isdigit()): raise ValueError(f"Invalid cursor: {cursor}")
+            clauses.append(f"(timestamp, id) {'<' if descending else '>'} (?, ?)"); params += [timestamp, int(row_id)]
+        direction = "DESC" if descending else "ASC"
+        rows = self.connection.execute(f"SELECT id, {self.COLUMNS} FROM locations WHERE {' AND '.join(clauses)} ORDER BY timestamp {direction}, id {direction} LIMIT ?", (*params, limit + 1)).fetchall()
+        next_cursor = f"{rows[limit - 1]['timestamp']}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+        return [{field: row[field] for field in ROW_FIELDS} for row in rows[:limit]], next_cursor
+
+    def max_id(self):
+        return self.connection.execute("SELECT MAX(id) FROM locations").fetchone()[0] or 0
+
+
+class MirroredLocationStore(LocationStore):
+    """Keeps Notion as the admin-editable system of record while serving reads locally.
+
+    Writes go to `primary` (Notion) first and are copied into `local` once
+    accepted. A background thread copies every row created or edited in
+    Notion since the last sync (by Notion's last_edited_time, kept in `local`)
+    every `interval` seconds, and every `reconcile_interval` seconds reads
+    all of Notion to drop local rows whose pages were deleted there. Processes
+    sharing the SQLite file elect one syncing process through a lease kept in
+    it, so Notion is read once however many workers run. Reads are answered by
+    `local` once the file has been synced; until then they fall through to
+    `primary`.
+    """
+
+    LEASE = 'mirror-sync'
+
+    def __init__(self, primary, local, interval=60, reconcile_interval=3600):
+        self.primary = primary
+        self.local = local
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.synced = threading.Event()
+        self._owner = uuid.uuid4().hex
+        self._lease_seconds = 3 * interval + 60
+        self._sync_started = False
+        self._lock = threading.Lock()
+
+    def start_sync(self):
+        with self._lock:
+            if self._sync_started: return
+            self._sync_started = True
+        threading.Thread(target=self._sync_loop, name='location-mirror-sync', daemon=True).start()
+
+    def _sync_loop(self):
+        # A local copy that has synced before only needs the changes; a new one reads everything anyway.
+        reconciled = time.monotonic() if self.local.get_state('notion_edited') else None
+        while True:
+            try:
+                reconciled = self._sync_step(reconciled)
+            except Exception as exc:
+                logger.error(f"MIRROR SYNC ERROR: {exc}")
+            time.sleep(self.interval)
+
+    def _sync_step(self, reconciled):
+        """One round of the loop: syncs if this process holds the lease (in full once
+        `reconcile_interval` has passed since `reconciled`). Returns the new `reconciled`."""
+        if not self.local.acquire_lease(self.LEASE, self._owner, self._lease_seconds):
+            # Another process holds the lease and keeps the shared file in sync.
+            if self.local.get_state('synced_at'): self.synced.set()
+            return reconciled
+        full = reconciled is None or time.monotonic() - reconciled >= self.reconcile_interval
+        self.sync(full)
+        self.synced.set()
+        return time.monotonic() if full else reconciled
+
+    def sync(self, full=False):
+        """Copies rows created or edited in Notion since the last sync. With `full`, reads every
+        row instead and deletes local rows whose Notion page no longer exists."""
+        since = None if full else self.local.get_state('notion_edited')
+        newest = since; seen = set(); max_id = self.local.max_id(); batch = []
+        for row in self.primary.iter_all_rows(edited_since=since):
+            batch.append(row); seen.add(row['notion_page_id'])
+            if newest is None or row['last_edited_time'] > newest: newest = row['last_edited_time']
+            if len(batch) >= 500:
+                self.local.upsert(batch); batch = []
+                # A full read can take minutes; keep the lease so no other process starts one too.
+                self.local.acquire_lease(self.LEASE, self._owner, self._lease_seconds)
+        if batch: self.local.upsert(batch)
+        # Rows written locally after the scan began (id > max_id) may be missing from it.
+        if full and self.local.delete_missing(seen, max_id): logger.info("Mirror sync removed rows deleted in Notion")
+        # Notion rounds last_edited_time to the minute, so the next sync reads that minute again.
+        if newest: self.local.set_state('notion_edited', newest)
+        self.local.set_state('synced_at', str(time.time()))
+
+    def _reader(self):
+        self.start_sync()
+        return self.local if self.synced.is_set() else self.primary
+
+    def write(self, rows):
+        results = self.primary.write(rows)
+        written = [dict(row, notion_page_id=result) for row, result in zip(rows, results) if result]
+        if written: self.local.write(written)
+        return results
+
+    def latest_positions(self, user_page_ids=None): return self._reader().latest_positions(user_page_ids)
+    def rows_since(self, watermark):
+        if self.synced.is_set() and not isinstance(watermark, int):
+            # The index was built from Notion before the local copy caught up; hand over to
+            # local row ids by replaying each user's newest local row.
+            positions, watermark = self.local.latest_positions()
+            return list(positions.values()), watermark
+        return self._reader().rows_since(watermark)
+    def history(self, user_page_id, limit=10): return self._reader().history(user_page_id, limit)
+    def iter_rows(self, user_page_id): return self._reader().iter_rows(user_page_id)
+    def query_range(self, user_page_id, start=None, end=None, cursor=None, limit=100, descending=True):
+        # Cursors are backend-specific, so a paging client must stay on the backend it started with.
+        reader = self.primary if cursor and '|' not in cursor else self._reader()
+        return reader.query_range(user_page_id, start, end, cursor, limit, descending)
@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+import cache
+from cache import TTLCache, VersionedCache
+
+
+class Clock:
+    def __init__(self): self.now = 1000.0
+    def __call__(self): return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_ttl_cache_expires_entries(clock):
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set('a', 1)
+    clock.now += 9
+    assert ttl_cache.get('a') == 1
+    clock.now += 2
+    assert ttl_cache.get('a') is None
+    assert len(ttl_cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    ttl_cache = TTLCache(maxsize=2)
+    ttl_cache.set('a', 1); ttl_cache.set('b', 2)
+    ttl_cache.get('a')
+    ttl_cache.set('c', 3)
+    assert ttl_cache.get('b') is None
+    assert (ttl_cache.get('a'), ttl_cache.get('c')) == (1, 3)
+
+
+def test_ttl_cache_invalidate_where_and_stats():
+    ttl_cache = TTLCache()
+    for key in range(4): ttl_cache.set(key, {'even': key % 2 == 0})
+    ttl_cache.invalidate_where(lambda value: value['even'])
+    assert [ttl_cache.get(key) is not None for key in range(4)] == [False, True, False, True]
+    assert ttl_cache.stats()['hits'] == 2 and ttl_cache.stats()['misses'] == 2
+
+
+def test_versioned_cache_loads_once_then_serves_cached(clock):
+    versioned = VersionedCache(ttl=60); loads = []
+    loader = lambda: loads.append(1) or 'value'
+    assert versioned.get_or_load('k', loader) == 'value'
+    assert versioned.get_or_load('k', loader) == 'value'
+    clock.now += 61
+    versioned.get_or_load('k', loader)
+    assert len(loads) == 2
+
+
+def test_versioned_cache_does_not_cache_failures():
+    versioned = VersionedCache(); results = iter([None, 'ok'])
+    assert versioned.get_or_load('k', lambda: next(results)) is None
+    assert versioned.get_or_load('k', lambda: next(results)) == 'ok'
+
+
+def test_write_during_load_wins_over_the_stale_load():
+    versioned = VersionedCache()
+
+    def stale_loader():
+        # A write lands while the slow read is still in flight.
+        versioned.set('setting', 'written')
+        return 'read before the write'
+
+    assert versioned.get_or_load('setting', stale_loader) == 'read before the write'
+    assert versioned.get_or_load('setting', lambda: pytest.fail('should be cached')) == 'written'
+
+
+def test_invalidate_during_load_discards_the_load():
+    versioned = VersionedCache(); loads = []
+
+    def loader():
+        loads.append(1)
+        if len(loads) == 1: versioned.invalidate('users')
+        return len(loads)
+
+    assert versioned.get_or_load('users', loader) == 1
+    assert versioned.get_or_load('users', loader) == 2
+    assert versioned.get_or_load('users', loader) == 2
+
+
+def test_concurrent_misses_share_one_load():
+    versioned = VersionedCache(); started = threading.Event(); release = threading.Event(); loads = []
+
+    def loader():
+        loads.append(1); started.set(); release.wait(5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(versioned.get_or_load('k', loader))) for _ in range(5)]
+    threads[0].start(); started.wait(5)
+    for thread in threads[1:]: thread.start()
+    release.set()
+    for thread in threads: thread.join(5)
+    assert results == ['value'] * 5
+    assert len(loads) == 1
@@ -0,0 +1,61 @@
+import math
+import random
+
+import pytest
+
+from geofence_index import EARTH_RADIUS_M, GeofenceSet, haversine
+
+
+def destination(lat, lon, bearing, distance):
+    """The point `distance` metres from (lat, lon) along `bearing` degrees, on haversine's sphere."""
+    angle = distance / EARTH_RADIUS_M; phi = math.radians(lat); theta = math.radians(bearing)
+    phi2 = math.asin(math.sin(phi) * math.cos(angle) + math.cos(phi) * math.sin(angle) * math.cos(theta))
+    lambda2 = math.radians(lon) + math.atan2(math.sin(theta) * math.sin(angle) * math.cos(phi), math.cos(angle) - math.sin(phi) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lambda2) + 540) % 360 - 180
+
+
+def zone(name, lat, lon, radius):
+    return {'name': name, 'lat': lat, 'lon': lon, 'radius': radius}
+
+
+@pytest.mark.parametrize('lat', [0, 10, 45, 60, 80, 89, -70])
+@pytest.mark.parametrize('radius', [50, 1000, 50000, 1000000])
+@pytest.mark.parametrize('bearing', [0, 45, 90, 180, 270])
+def test_boundary_points(lat, radius, bearing):
+    geofences = GeofenceSet([zone('z', lat, 20, radius)])
+    inside = destination(lat, 20, bearing, radius * 0.9995)
+    outside = destination(lat, 20, bearing, radius * 1.0005)
+    assert [match['name'] for match in geofences.matches(*inside)] == ['z']
+    assert geofences.matches(*outside) == []
+
+
+def test_point_half_a_metre_inside_matches():
+    geofences = GeofenceSet([zone('z', 10, 10, 1000)])
+    lat = 10 + math.degrees(999.5 / EARTH_RADIUS_M)
+    assert haversine(10, 10, lat, 10) < 1000
+    assert len(geofences.matches(lat, 10)) == 1
+
+
+def test_zone_over_the_pole_and_antimeridian():
+    geofences = GeofenceSet([zone('pole', 89.9, 0, 50000), zone('dateline', 0, 179.99, 5000)])
+    assert [match['name'] for match in geofences.matches(89.9, 180)] == ['pole']
+    assert [match['name'] for match in geofences.matches(0, -179.99)] == ['dateline']
+
+
+def test_returns_every_matching_zone_and_skips_incomplete_ones():
+    geofences = GeofenceSet([zone('a', 40, -74, 2000), zone('b', 40.001, -74, 2000), zone('c', 41, -74, 100), {'name': 'broken', 'lat': None, 'lon': -74, 'radius': 10}])
+    assert len(geofences) == 3
+    assert sorted(match['name'] for match in geofences.matches(40, -74)) == ['a', 'b']
+
+
+def test_matches_many_agrees_with_brute_force_near_edges():
+    rng = random.Random(7)
+    zones = [zone(f'z{index}', rng.uniform(-80, 80), rng.uniform(-180, 180), rng.choice([100, 5000, 200000])) for index in range(40)]
+    geofences = GeofenceSet(zones, cell_deg=0.5, max_cells=64)
+    points = []
+    for _ in range(2000):
+        target = rng.choice(zones)
+        points.append(destination(target['lat'], target['lon'], rng.uniform(0, 360), target['radius'] * rng.choice([0.999, 1.001, 0.5, 2])))
+    for (lat, lon), matched in zip(points, geofences.matches_many(points)):
+        expected = sorted(z['name'] for z in zones if haversine(lat, lon, z['lat'], z['lon']) <= z['radius'])
+        assert sorted(match['name'] for match in matched) == expected
@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+import ingest
+from ingest import Spool
+
+
+@pytest.fixture
+def processes(monkeypatch):
+    """Pretends to be process `processes.pid`; only pids in `processes.alive` are running."""
+    class Processes:
+        pid = 200
+        alive = set()
+    monkeypatch.setattr(os, 'getpid', lambda: Processes.pid)
+    monkeypatch.setattr(ingest, '_pid_alive', lambda pid: pid in Processes.alive)
+    return Processes
+
+
+def write_journal(directory, name, records):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as handle:
+        for record in records: handle.write(json.dumps(record) + "\n")
+
+
+def ping(ping_id): return {'id': ping_id, 'latitude': 1.0, 'longitude': 2.0}
+
+
+def test_recovers_unacknowledged_pings_from_dead_journals(tmp_path, processes):
+    write_journal(tmp_path, 'spool-100.jsonl', [{'op': 'put', 'ping': ping('a')}, {'op': 'put', 'ping': ping('b')}, {'op': 'ack', 'id': 'a'}])
+    write_journal(tmp_path, 'spool-101.jsonl', [{'op': 'put', 'ping': ping('c')}])
+    processes.alive = {101}
+    spool = Spool(str(tmp_path), fsync=False)
+    assert [p['id'] for p in spool.recover()] == ['b']
+    assert sorted(os.listdir(tmp_path)) == ['spool-101.jsonl', 'spool-200.jsonl']
+    # The adopted ping is now in our own journal, so it survives us crashing before it is written.
+    processes.pid = 300
+    assert [p['id'] for p in Spool(str(tmp_path), fsync=False).recover()] == ['b']
+
+
+def test_each_dead_journal_is_adopted_once(tmp_path, processes):
+    write_journal(tmp_path, 'spool-100.jsonl', [{'op': 'put', 'ping': ping('a')}])
+    first = Spool(str(tmp_path), fsync=False)
+    processes.pid = 201
+    second = Spool(str(tmp_path), fsync=False)
+    processes.alive = {200, 201}
+    processes.pid = 200
+    assert [p['id'] for p in first.recover()] == ['a']
+    processes.pid = 201
+    assert second.recover() == []
+
+
+def test_claimed_journal_of_a_crashed_adopter_is_recovered(tmp_path, processes):
+    write_journal(tmp_path, 'spool-100.jsonl', [{'op': 'put', 'ping': ping('a')}])
+    adopter = Spool(str(tmp_path), fsync=False)
+    adopter._claim(str(tmp_path / 'spool-100.jsonl'))
+    # The adopter (pid 200) dies before saving the pings; the next process picks the claim up.
+    processes.pid = 300
+    assert [p['id'] for p in Spool(str(tmp_path), fsync=False).recover()] == ['a']
+    assert os.listdir(tmp_path) == ['spool-300.jsonl']
+
+
+def test_compaction_keeps_pings_that_are_not_acknowledged(tmp_path, processes):
+    spool = Spool(str(tmp_path), fsync=False)
+    spool.put([ping('a'), ping('b'), ping('c')])
+    spool.ack(['a']); spool.ack(['c'], op="drop")
+    # 'b' is off the queue in a worker's hands: nothing in memory says it is outstanding.
+    spool.compact()
+    processes.pid = 300
+    assert [p['id'] for p in Spool(str(tmp_path), fsync=False).recover()] == ['b']
@@ -0,0 +1,103 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import notion_client
+from notion_client import NotionClient, TokenBucket, never_sent
+
+
+class Clock:
+    def __init__(self): self.now = 1000.0
+    def __call__(self): return self.now
+    def sleep(self, seconds): self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(notion_client.time, 'monotonic', clock)
+    monkeypatch.setattr(notion_client.time, 'sleep', clock.sleep)
+    return clock
+
+
+class Response:
+    def __init__(self, status_code): self.status_code = status_code; self.headers = {}
+
+
+class Session:
+    """Answers each call with the next scripted response, raising it if it is an exception."""
+    def __init__(self, outcomes): self.outcomes = list(outcomes); self.calls = 0
+    def request(self, method, url, json=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception): raise outcome
+        return Response(outcome)
+
+
+def make_client(outcomes):
+    client = NotionClient('key', rate_limit=1000.0, max_retries=3)
+    client._session = Session(outcomes)
+    return client
+
+
+def refused():
+    return requests.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused')))
+
+
+def reset():
+    return requests.ConnectionError(ProtocolError('Connection aborted.', ConnectionResetError(104, 'reset')))
+
+
+def test_concurrent_pauses_share_one_deadline(clock):
+    bucket = TokenBucket(3.0)
+    for _ in range(4): bucket.pause(1.0)
+    assert bucket.acquire() == pytest.approx(1.0)
+    assert clock.now == pytest.approx(1001.0)
+
+
+def test_pause_extends_to_the_later_deadline(clock):
+    bucket = TokenBucket(3.0)
+    bucket.pause(2.0); clock.now += 0.5; bucket.pause(1.0)
+    bucket.acquire()
+    assert clock.now == pytest.approx(1002.0)
+
+
+def test_never_sent_only_for_connections_that_were_not_made():
+    assert never_sent(refused())
+    assert never_sent(requests.ConnectTimeout())
+    assert not never_sent(reset())
+    assert not never_sent(requests.ReadTimeout())
+
+
+def test_queries_retry_server_errors_and_timeouts(clock):
+    client = make_client([503, requests.ReadTimeout(), 200])
+    assert client.post('databases/db/query', json={}).status_code == 200
+    assert client._session.calls == 3
+
+
+@pytest.mark.parametrize('outcome', [500, 502, 503, 504])
+def test_page_creation_is_not_retried_after_server_errors(clock, outcome):
+    client = make_client([outcome, 200])
+    assert client.post('pages', json={}).status_code == outcome
+    assert client._session.calls == 1
+
+
+@pytest.mark.parametrize('outcome', [requests.ReadTimeout(), reset()])
+def test_page_creation_is_not_retried_once_sent(clock, outcome):
+    client = make_client([outcome, 200])
+    with pytest.raises(requests.RequestException): client.post('pages', json={})
+    assert client._session.calls == 1
+
+
+@pytest.mark.parametrize('outcome', [429, requests.ConnectTimeout(), refused()])
+def test_page_creation_retries_what_notion_never_acted_on(clock, outcome):
+    client = make_client([outcome, 200])
+    assert client.post('pages', json={}).status_code == 200
+    assert client._session.calls == 2
+
+
+def test_idempotent_flag_overrides_the_default(clock):
+    client = make_client([503, 200])
+    assert client.request('POST', 'pages', json={}, idempotent=True).status_code == 200
+    client = make_client([503, 200])
+    assert client.request('PATCH', 'pages/abc', json={}, idempotent=False).status_code == 503
@@ -0,0 +1,149 @@
+import pytest
+from flask import Flask
+from flask_login import LoginManager
+
+import models
+import routes
+from storage import SQLiteLocationStore
+
+
+class StubUser:
+    is_authenticated = True; is_active = True; is_anonymous = False
+    id = 'user-1'; page_id = 'page-1'; username = 'alice'; role = 'Admin'
+    def get_id(self): return self.id
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    login_manager = LoginManager(app)
+    login_manager.request_loader(lambda request: StubUser())
+    app.register_blueprint(routes.main)
+    return app.test_client()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SQLiteLocationStore(str(tmp_path / 'locations.db'))
+    monkeypatch.setattr(models, 'location_store', store)
+    return store
+
+
+def row(timestamp, latitude=1.0):
+    return {'user_page_id': 'page-1', 'timestamp': timestamp, 'latitude': latitude, 'longitude': 2.0, 'ip_address': '1.2.3.4', 'battery': '80', 'device_info': 'test'}
+
+
+@pytest.mark.parametrize('value', ['abcZ', 'Z', '2024-13-01T00:00:00Z', 'yesterday', '1e999', '10000000000000000000'])
+def test_history_rejects_malformed_times(client, store, value):
+    response = client.get(f'/admin/get_location_history/page-1?from={value}')
+    assert response.status_code == 400
+    assert 'from' in response.get_json()['error']
+
+
+def test_history_accepts_iso_and_epoch_times(client, store):
+    store.write([row('2024-01-01T00:00:00Z'), row('2024-01-02T00:00:00Z'), row('2024-01-03T00:00:00Z')])
+    for start in ['2024-01-02T00:00:00Z', '2024-01-02T01:00:00+01:00', '2024-01-02', '1704153600']:
+        points = client.get('/admin/get_location_history/page-1', query_string={'from': start, 'order': 'asc'}).get_json()['points']
+        assert [point['timestamp'][:10] for point in points] == ['2024-01-02', '2024-01-03'], start
+
+
+@pytest.mark.parametrize('cursor', ['abc', '2024-01-01T00:00:00Z|x', '|5'])
+def test_history_rejects_malformed_cursors(client, store, cursor):
+    assert client.get(f'/admin/get_location_history/page-1?cursor={cursor}').status_code == 400
+
+
+def test_history_pages_with_cursors(client, store):
+    store.write([row(f'2024-01-0{day}T00:00:00Z') for day in range(1, 6)])
+    first = client.get('/admin/get_location_history/page-1?limit=2').get_json()
+    second = client.get(f"/admin/get_location_history/page-1?limit=2&cursor={first['next_cursor']}").get_json()
+    assert [point['timestamp'][:10] for point in first['points'] + second['points']] == [f'2024-01-0{day}' for day in range(5, 1, -1)]
+
+
+def test_truncated_simplified_history_keeps_the_newest_rows(client, store, monkeypatch):
+    monkeypatch.setattr(models, 'HISTORY_MAX_ROWS', 3)
+    store.write([row(f'2024-01-0{day}T00:00:00Z', latitude=day) for day in range(1, 6)])
+    body = client.get('/admin/get_location_history/page-1?max_points=10&order=asc').get_json()
+    assert body['truncated'] is True
+    assert [point['timestamp'][:10] for point in body['points']] == ['2024-01-03', '2024-01-04', '2024-01-05']
+
+
+class StubLog:
+    """Stands in for models.log_locations: records each batch and answers with `results` (all written by default)."""
+    def __init__(self): self.batches = []; self.results = None
+    def __call__(self, pings):
+        self.batches.append(pings)
+        return self.results.pop(0) if self.results else [f'page-{index}' for index in range(len(pings))]
+
+
+@pytest.fixture
+def log(monkeypatch):
+    import ingest
+    log = StubLog()
+    monkeypatch.setattr(routes, 'INGEST_MODE', 'sync')
+    monkeypatch.setattr(routes, 'log_locations', log)
+    monkeypatch.setattr(routes, 'check_geofences', lambda points: [[] for _ in points])
+    ingest.recent_pings.clear()
+    return log
+
+
+def test_batch_of_json_points_is_logged(client, log):
+    body = {'battery': '50', 'points': [{'latitude': 1.5, 'longitude': 2.5, 'timestamp': '2024-01-01T00:00:00Z'}, {'latitude': 1.6, 'longitude': 2.6, 'timestamp': 1704067260000, 'battery': '49'}]}
+    response = client.post('/user/send_locations', json=body)
+    assert response.status_code == 200
+    assert response.get_json()['accepted'] == 2
+    [pings] = log.batches
+    assert [(ping['timestamp'], ping['battery'], ping['user_page_id']) for ping in pings] == [('2024-01-01T00:00:00.000000Z', '50', 'page-1'), ('2024-01-01T00:01:00.000000Z', '49', 'page-1')]
+
+
+def test_delta_rows_are_decoded(client, log):
+    body = {'encoding': 'delta', 'scale': 1000, 'points': [[1704067200000, 1500, -2500], [60000, 10, -10], [60000, 0, 5]]}
+    assert client.post('/user/send_locations', json=body).status_code == 200
+    assert [(ping['timestamp'][11:19], ping['latitude'], ping['longitude']) for ping in log.batches[0]] == [('00:00:00', 1.5, -2.5), ('00:01:00', 1.51, -2.51), ('00:02:00', 1.51, -2.505)]
+
+
+def test_future_and_out_of_range_points_are_rejected(client, log):
+    body = [{'latitude': 1, 'longitude': 2, 'timestamp': '2999-01-01T00:00:00Z'}, {'latitude': 91, 'longitude': 2, 'timestamp': '2024-01-01T00:00:00Z'},
+            {'latitude': 1, 'longitude': 2, 'timestamp': 'soon'}, {'longitude': 2}, {'latitude': 1, 'longitude': 2, 'timestamp': '2024-01-01T00:00:00Z'}]
+    summary = client.post('/user/send_locations', json=body).get_json()
+    assert (summary['accepted'], summary['rejected']) == (1, 4)
+
+
+def test_resent_batches_are_not_logged_twice(client, log):
+    body = [{'latitude': 1, 'longitude': 2, 'timestamp': '2024-01-01T00:00:00Z'}, {'latitude': 1, 'longitude': 2, 'timestamp': '2024-01-01T00:00:00Z'}]
+    assert client.post('/user/send_locations', json=body).get_json()['duplicates'] == 1
+    assert client.post('/user/send_locations', json=body).get_json()['duplicates'] == 2
+    assert len(log.batches) == 1
+
+
+def test_partial_failure_returns_503_and_the_retry_sends_only_the_rest(client, log):
+    body = [{'latitude': 1, 'longitude': 2, 'timestamp': '2024-01-01T00:00:00Z'}, {'latitude': 1, 'longitude': 2, 'timestamp': '2024-01-01T00:01:00Z'}]
+    log.results = [['page-a', None]]
+    response = client.post('/user/send_locations', json=body)
+    assert response.status_code == 503
+    assert response.get_json()['accepted'] == 1
+    retry = client.post('/user/send_locations', json=body).get_json()
+    assert (retry['accepted'], retry['duplicates']) == (1, 1)
+    assert [ping['timestamp'][11:16] for ping in log.batches[1]] == ['00:01']
+
+
+def test_hard_failures_are_reported_as_rejected(client, log):
+    log.results = [[False]]
+    response = client.post('/user/send_locations', json=[{'latitude': 1, 'longitude': 2, 'timestamp': '2024-01-01T00:00:00Z'}])
+    assert response.status_code == 200
+    assert (response.get_json()['accepted'], response.get_json()['rejected']) == (0, 1)
+
+
+@pytest.mark.parametrize('body', [{'points': 'x'}, {'encoding': 'zip', 'points': []}, {'encoding': 'delta', 'points': [['a', 1, 2]]}, {'encoding': 'delta', 'points': [[1, None, 2]]},
+                                  {'encoding': 'delta', 'points': [[1, 2]]}, {'encoding': 'delta', 'scale': 'big', 'points': []}, {'encoding': 'delta', 'scale': 0, 'points': []}, 'text'])
+def test_malformed_batches_get_a_fixed_400(client, log, body):
+    response = client.post('/user/send_locations', json=body)
+    assert response.status_code == 400
+    message = response.get_json()['message']
+    assert message in ("Expected a list of points.", "Unknown encoding: zip", "scale must be a positive number.", "Delta rows must be [t, lat, lon] numbers.")
+    assert not log.batches
+
+
+def test_oversized_batches_are_refused(client, log, monkeypatch):
+    monkeypatch.setattr(routes, 'BATCH_MAX_POINTS', 2)
+    assert client.post('/user/send_locations', json=[{'latitude': 1, 'longitude': 2}] * 3).status_code == 413
@@ -0,0 +1,138 @@
+import pytest
+
+import storage
+from storage import MirroredLocationStore, SQLiteLocationStore
+
+
+def row(page_id, timestamp='2024-01-01T00:00:00Z', latitude=1.0, edited='2024-01-01T00:00:00.000Z', user='page-1'):
+    return {'notion_page_id': page_id, 'user_page_id': user, 'timestamp': timestamp, 'latitude': latitude, 'longitude': 2.0, 'ip_address': '1.2.3.4', 'battery': '80', 'device_info': 'test', 'last_edited_time': edited}
+
+
+class StubNotion:
+    """Stands in for NotionLocationStore: `pages` maps page id -> row."""
+    def __init__(self, rows, during_scan=None):
+        self.pages = {item['notion_page_id']: item for item in rows}
+        self.during_scan = during_scan
+        self.since = []
+
+    def iter_all_rows(self, edited_since=None):
+        self.since.append(edited_since)
+        # The scan sees the pages as they were when it began.
+        items = [item for item in sorted(self.pages.values(), key=lambda item: item['last_edited_time']) if not edited_since or item['last_edited_time'] >= edited_since]
+        if self.during_scan: self.during_scan()
+        yield from items
+
+    def write(self, rows):
+        results = []
+        for item in rows:
+            page_id = f"new-{len(self.pages)}"
+            self.pages[page_id] = dict(item, notion_page_id=page_id, last_edited_time='2024-01-09T00:00:00.000Z')
+            results.append(page_id)
+        return results
+
+
+@pytest.fixture
+def local(tmp_path):
+    return SQLiteLocationStore(str(tmp_path / 'locations.db'))
+
+
+def page_ids(store):
+    return sorted((item['notion_page_id'] for item in store.connection.execute("SELECT notion_page_id FROM locations")), key=str)
+
+
+def test_upsert_inserts_then_updates_by_notion_page(local):
+    local.upsert([row('a'), row('b')])
+    local.upsert([row('a', latitude=5.0)])
+    rows = {item['notion_page_id']: item for item in local.iter_rows('page-1')}
+    assert sorted(rows) == ['a', 'b']
+    assert rows['a']['latitude'] == 5.0
+
+
+def test_delete_missing_only_touches_rows_up_to_max_id(local):
+    local.upsert([row('a'), row('b'), row('c')])
+    max_id = local.max_id()
+    local.upsert([row('d')])
+    local.write([dict(row(None), notion_page_id=None)])
+    assert local.delete_missing({'a'}, max_id) == 2
+    # 'd' arrived after the scan began; the unsynced local row has no page to check.
+    assert page_ids(local) == [None, 'a', 'd']
+
+
+def test_full_sync_copies_notion_and_drops_deleted_pages(local):
+    notion = StubNotion([row('a'), row('b'), row('c')])
+    mirror = MirroredLocationStore(notion, local)
+    mirror.sync(full=True)
+    assert page_ids(local) == ['a', 'b', 'c']
+    del notion.pages['b']
+    notion.pages['c'] = row('c', latitude=9.0, edited='2024-01-02T00:00:00.000Z')
+    mirror.sync(full=True)
+    assert page_ids(local) == ['a', 'c']
+    assert {item['notion_page_id']: item['latitude'] for item in local.iter_rows('page-1')}['c'] == 9.0
+
+
+def test_rows_written_during_a_full_sync_survive(local):
+    notion = StubNotion([row('a'), row('b')])
+    mirror = MirroredLocationStore(notion, local)
+    local.upsert([row('a'), row('b')])
+    # A ping is written through the mirror after the scan has started, so the scan misses it.
+    notion.during_scan = lambda: mirror.write([row(None, timestamp='2024-01-03T00:00:00Z')])
+    mirror.sync(full=True)
+    assert page_ids(local) == ['a', 'b', 'new-2']
+
+
+def test_incremental_sync_reads_from_the_last_edit_seen(local):
+    notion = StubNotion([row('a', edited='2024-01-01T00:00:00.000Z'), row('b', edited='2024-01-05T00:00:00.000Z')])
+    mirror = MirroredLocationStore(notion, local)
+    mirror.sync(full=True)
+    notion.pages['c'] = row('c', edited='2024-01-06T00:00:00.000Z')
+    del notion.pages['a']
+    mirror.sync()
+    assert notion.since == [None, '2024-01-05T00:00:00.000Z']
+    # Deletions wait for the next full sync.
+    assert page_ids(local) == ['a', 'b', 'c']
+    assert local.get_state('notion_edited') == '2024-01-06T00:00:00.000Z'
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_keyset_pages_cover_equal_timestamps_once(local, descending):
+    local.upsert([row(f'p{index}', timestamp=f'2024-01-0{1 + index // 3}T00:00:00Z') for index in range(8)])
+    seen = []; cursor = None
+    while True:
+        page, cursor = local.query_range('page-1', cursor=cursor, limit=3, descending=descending)
+        seen.extend(page)
+        if not cursor: break
+    assert sorted(item['notion_page_id'] for item in seen) == [f'p{index}' for index in range(8)]
+    timestamps = [item['timestamp'] for item in seen]
+    assert timestamps == sorted(timestamps, reverse=descending)
+
+
+def test_keyset_pages_respect_the_time_range(local):
+    local.upsert([row(f'p{day}', timestamp=f'2024-01-0{day}T00:00:00Z') for day in range(1, 8)])
+    page, cursor = local.query_range('page-1', '2024-01-02T00:00:00.000000Z', '2024-01-05T00:00:00.000000Z', limit=2, descending=False)
+    rest, end = local.query_range('page-1', '2024-01-02T00:00:00.000000Z', '2024-01-05T00:00:00.000000Z', cursor=cursor, limit=2, descending=False)
+    assert [item['notion_page_id'] for item in page + rest] == ['p2', 'p3', 'p4', 'p5']
+    assert end is None
+
+
+def test_only_one_process_holds_the_sync_lease(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(storage.time, 'time', lambda: now[0])
+    first = SQLiteLocationStore(str(tmp_path / 'shared.db')); second = SQLiteLocationStore(str(tmp_path / 'shared.db'))
+    assert first.acquire_lease('mirror-sync', 'worker-1', 60)
+    assert not second.acquire_lease('mirror-sync', 'worker-2', 60)
+    now[0] += 30
+    assert first.acquire_lease('mirror-sync', 'worker-1', 60)
+    now[0] += 61
+    assert second.acquire_lease('mirror-sync', 'worker-2', 60)
+    assert not first.acquire_lease('mirror-sync', 'worker-1', 60)
+
+
+def test_workers_sharing_a_file_sync_once(tmp_path):
+    notion = StubNotion([row('a')])
+    path = str(tmp_path / 'shared.db')
+    leader = MirroredLocationStore(notion, SQLiteLocationStore(path)); follower = MirroredLocationStore(notion, SQLiteLocationStore(path))
+    assert not follower.synced.is_set()
+    leader._sync_step(None); follower._sync_step(None)
+    assert notion.since == [None]
+    assert leader.synced.is_set() and follower.synced.is_set()
+    assert page_ids(follower.local) == ['a']
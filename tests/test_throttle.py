@@ -0,0 +1,49 @@
+import pytest
+
+import throttle
+from throttle import SlidingWindowLimiter
+
+
+class Clock:
+    def __init__(self): self.now = 1000.0
+    def __call__(self): return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, 'monotonic', clock)
+    return clock
+
+
+def test_allows_limit_hits_per_window(clock):
+    limiter = SlidingWindowLimiter(3, 60)
+    assert [limiter.hit('ip') for _ in range(3)] == [0.0, 0.0, 0.0]
+    clock.now += 10
+    assert limiter.hit('ip') == pytest.approx(50)
+    assert limiter.retry_after('ip') == pytest.approx(50)
+    assert limiter.retry_after('other') == 0.0
+
+
+def test_window_slides(clock):
+    limiter = SlidingWindowLimiter(2, 60)
+    limiter.hit('ip'); clock.now += 30; limiter.hit('ip')
+    clock.now += 31
+    assert limiter.hit('ip') == 0.0
+    assert limiter.hit('ip') == pytest.approx(29)
+
+
+def test_blocked_hits_are_not_recorded(clock):
+    limiter = SlidingWindowLimiter(3, 60)
+    for _ in range(1000): limiter.hit('ip')
+    assert len(limiter._hits['ip']) == 3
+    clock.now += 60
+    assert limiter.hit('ip') == 0.0
+
+
+def test_reset_and_maxsize():
+    limiter = SlidingWindowLimiter(1, 60, maxsize=2)
+    limiter.hit('a'); limiter.hit('b'); limiter.hit('c')
+    assert limiter.retry_after('a') == 0.0 and limiter.retry_after('c') > 0
+    limiter.reset('c')
+    assert limiter.hit('c') == 0.0
@@ -0,0 +1,65 @@
+import math
+from datetime import datetime
+
+from geofence_index import EARTH_RADIUS_M, GeofenceSet
+from tracks import UNKNOWN_BATTERY, Track, battery_level, epoch
+
+BASE = 1704067200  # 2024-01-01T00:00:00Z
+METRE = math.degrees(1 / EARTH_RADIUS_M)
+
+
+def row(seconds, lat, lon, battery='Charging: No, Level: 80%'):
+    return {'timestamp': datetime.utcfromtimestamp(BASE + seconds).strftime('%Y-%m-%dT%H:%M:%SZ'), 'latitude': lat, 'longitude': lon, 'battery': battery}
+
+
+def test_battery_level():
+    assert battery_level('Charging: No, Level: 80%') == 80
+    assert battery_level('Level: 150 %') == 100
+    assert battery_level(None) == UNKNOWN_BATTERY
+    assert battery_level('N/A') == UNKNOWN_BATTERY
+
+
+def test_extend_sorts_out_of_order_rows_and_skips_missing_coordinates():
+    track = Track().extend([row(60, 1, 1), row(0, 0, 0), row(30, None, 0)])
+    assert list(track.times) == [BASE, BASE + 60]
+    assert list(track.lats) == [0, 1]
+    assert track.last_timestamp == row(60, 1, 1)['timestamp']
+
+
+def test_between_is_inclusive():
+    track = Track().extend([row(seconds, 0, 0) for seconds in range(0, 600, 60)])
+    window = track.between(epoch(row(120, 0, 0)['timestamp']), epoch(row(240, 0, 0)['timestamp']))
+    assert list(window.times) == [BASE + 120, BASE + 180, BASE + 240]
+    assert len(track.between()) == 10
+
+
+def test_step_distances_are_extended_incrementally():
+    rows = [row(index * 60, 0, index * 100 * METRE) for index in range(10)]
+    track = Track().extend(rows[:5])
+    track.step_distances()
+    track.extend(rows[5:])
+    incremental = list(track.step_distances())
+    assert incremental == list(Track().extend(rows).step_distances())
+    assert len(incremental) == 9 and all(abs(distance - 100) < 0.01 for distance in incremental)
+
+
+def test_stops_find_a_stay_and_ignore_movement():
+    moving = [row(index * 60, 0, index * 500 * METRE) for index in range(5)]
+    staying = [row(300 + index * 60, 0, 2500 * METRE + (index % 2) * 10 * METRE) for index in range(11)]
+    stops = Track().extend(moving + staying).stops(radius_m=50, min_seconds=300)
+    assert len(stops) == 1
+    assert stops[0]['seconds'] == 600 and stops[0]['points'] == 11
+
+
+def test_dwell_times_count_visits_and_time_inside():
+    home = GeofenceSet([{'name': 'home', 'lat': 0, 'lon': 0, 'radius': 100}])
+    rows = [row(0, 0, 0), row(60, 0, 0), row(120, 0, 1), row(180, 0, 0), row(240, 0, 0), row(10000, 0, 0)]
+    assert Track().extend(rows).dwell_times(home, max_gap=7200) == {'home': {'seconds': 120, 'visits': 2}}
+
+
+def test_summary_shape_is_the_same_for_an_empty_track():
+    rows = [row(index * 60, 0, index * 100 * METRE) for index in range(3)]
+    summary = Track().extend(rows).summary()
+    assert set(summary) == set(Track().summary())
+    assert summary['distance_m'] == 200.0 and summary['moving_seconds'] == 120
+    assert summary['battery'] == {'first': 80, 'last': 80, 'min': 80}
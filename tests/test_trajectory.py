@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+from trajectory import douglas_peucker, time_bucket_decimate
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def track(coordinates, step=60):
+    return [{'timestamp': (START + timedelta(seconds=index * step)).strftime('%Y-%m-%dT%H:%M:%SZ'), 'latitude': lat, 'longitude': lon} for index, (lat, lon) in enumerate(coordinates)]
+
+
+def test_short_tracks_are_returned_unchanged():
+    points = track([(0, 0), (0, 1)])
+    assert douglas_peucker(points, 5) == points
+    assert time_bucket_decimate(points, 5) == points
+
+
+def test_douglas_peucker_keeps_the_corner_of_an_l_shape():
+    points = track([(0, lon / 100) for lon in range(11)] + [(lat / 100, 0.1) for lat in range(1, 11)])
+    assert [(p['latitude'], p['longitude']) for p in douglas_peucker(points, 3)] == [(0, 0), (0, 0.1), (0.1, 0.1)]
+
+
+def test_douglas_peucker_respects_max_points_and_tolerance():
+    points = track([(0.001 * (index % 2), index / 1000) for index in range(200)])
+    simplified = douglas_peucker(points, 20)
+    assert len(simplified) == 20
+    assert simplified[0] is points[0] and simplified[-1] is points[-1]
+    assert [p['timestamp'] for p in simplified] == sorted(p['timestamp'] for p in simplified)
+    # The zigzag strays at most about 111 m from the end-to-end line, so 200 m keeps only the end points.
+    assert len(douglas_peucker(points, 20, tolerance_m=200)) == 2
+
+
+def test_time_bucket_decimate_keeps_one_point_per_bucket_and_the_last():
+    points = track([(0, index / 1000) for index in range(100)])
+    kept = time_bucket_decimate(points, 10)
+    assert len(kept) <= 10
+    assert kept[0] is points[0] and kept[-1] is points[-1]
+    assert len({p['timestamp'] for p in kept}) == len(kept)
+
+
+def test_time_bucket_decimate_handles_identical_timestamps():
+    points = track([(0, index / 1000) for index in range(10)], step=0)
+    assert time_bucket_decimate(points, 3) == [points[0], points[-1]]
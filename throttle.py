@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import request
+
+LOGIN_WINDOW_SECONDS = float(os.getenv('LOGIN_WINDOW_SECONDS', '300'))
+LOGIN_MAX_PER_IP = int(os.getenv('LOGIN_MAX_PER_IP', '30'))
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv('LOGIN_MAX_FAILURES_PER_USER', '5'))
+
+
+class SlidingWindowLimiter:
+    """Allows at most `limit` hits per key within any `window` seconds.
+
+    Keys are kept in LRU order and capped at `maxsize`, so a flood of distinct
+    keys (spoofed usernames, rotating IPs) can't grow memory without bound.
+    """
+
+    def __init__(self, limit, window, maxsize=10000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        hits = self._hits.get(key)
+        if hits is None: return None
+        while hits and now - hits[0] >= self.window: hits.popleft()
+        return hits
+
+    def retry_after(self, key):
+        """Seconds until `key` may hit again, or 0 if it is under the limit."""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._recent(key, now)
+            if not hits or len(hits) < self.limit: return 0.0
+            return self.window - (now - hits[0])
+
+    def hit(self, key):
+        """Records a hit, or returns the seconds to wait if `key` is already at the limit."""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._recent(key, now)
+            if hits is None: hits = self._hits[key] = deque()
+            self._hits.move_to_end(key)
+            # A blocked hit isn't recorded, so a key hammering away holds at most `limit` entries.
+            if len(hits) >= self.limit: return self.window - (now - hits[0])
+            hits.append(now)
+            while len(self._hits) > self.maxsize: self._hits.popitem(last=False)
+            return 0.0
+
+    def reset(self, key):
+        with self._lock: self._hits.pop(key, None)
+
+
+# Every login/signup POST counts against the client IP; only failed logins count against a username.
+ip_limiter = SlidingWindowLimiter(LOGIN_MAX_PER_IP, LOGIN_WINDOW_SECONDS)
+username_limiter = SlidingWindowLimiter(LOGIN_MAX_FAILURES_PER_USER, LOGIN_WINDOW_SECONDS)
+
+
+def client_ip():
+    """The peer address. X-Forwarded-For is set by the client and can't be trusted here; app.py
+    applies ProxyFix for TRUSTED_PROXY_HOPS proxies, which rewrites remote_addr from it."""
+    return request.remote_addr
@@ -0,0 +1,152 @@
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from geofence_index import EARTH_RADIUS_M
+
+UNKNOWN_BATTERY = 255
+_BATTERY_LEVEL = re.compile(r'(\d{1,3})\s*%')
+
+
+def epoch(timestamp):
+    """Whole epoch seconds for an ISO 8601 timestamp."""
+    return int(datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp())
+
+
+def battery_level(text):
+    """Parses the browser's 'Charging: No, Level: 80%' string into 0-100, or UNKNOWN_BATTERY."""
+    match = _BATTERY_LEVEL.search(text or '')
+    return min(100, int(match.group(1))) if match else UNKNOWN_BATTERY
+
+
+def _iso(seconds):
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Track:
+    """One user's location history as parallel typed arrays, oldest first.
+
+    Each point costs 17 bytes (int64 epoch seconds, float32 lat/lon, uint8
+    battery with 255 for unknown) rather than a dict of strings, and the
+    analytics below are single passes over the arrays.
+    """
+
+    def __init__(self):
+        self.times = array('q')
+        self.lats = array('f')
+        self.lons = array('f')
+        self.battery = array('B')
+        self.last_timestamp = None
+        self.truncated = False
+        self._steps = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def extend(self, rows):
+        """Appends store rows, re-sorting only if any arrive out of order."""
+        ordered = True
+        for row in rows:
+            if row['latitude'] is None or row['longitude'] is None: continue
+            seconds = epoch(row['timestamp'])
+            if self.times and seconds < self.times[-1]: ordered = False
+            self.times.append(seconds); self.lats.append(row['latitude']); self.lons.append(row['longitude'])
+            self.battery.append(battery_level(row.get('battery')))
+            if self.last_timestamp is None or row['timestamp'] > self.last_timestamp: self.last_timestamp = row['timestamp']
+        if not ordered:
+            order = sorted(range(len(self.times)), key=self.times.__getitem__)
+            for name in ('times', 'lats', 'lons', 'battery'):
+                column = getattr(self, name)
+                setattr(self, name, array(column.typecode, (column[index] for index in order)))
+            self._steps = None
+        return self
+
+    def between(self, start=None, end=None):
+        """A copy holding only the points with `start` <= time <= `end` (epoch seconds)."""
+        first = bisect_left(self.times, start) if start is not None else 0
+        last = bisect_right(self.times, end) if end is not None else len(self.times)
+        window = Track()
+        window.times = self.times[first:last]; window.lats = self.lats[first:last]
+        window.lons = self.lons[first:last]; window.battery = self.battery[first:last]
+        window.truncated = self.truncated
+        if self._steps is not None and len(self._steps) >= max(0, last - 1): window._steps = self._steps[first:max(first, last - 1)]
+        return window
+
+    def step_distances(self):
+        """Haversine metres between each point and the next (len - 1 values). Computed once and
+        then only for newly appended points, since a cached track is extended in place."""
+        done = len(self._steps) + 1 if self._steps is not None else 0
+        if self._steps is None: self._steps = array('d')
+        if done >= len(self.times): return self._steps
+        radians = math.radians; sin = math.sin; cos = math.cos; asin = math.asin; sqrt = math.sqrt
+        start = max(0, done - 1)
+        phis = [radians(lat) for lat in self.lats[start:]]; lambdas = [radians(lon) for lon in self.lons[start:]]
+        cosines = [cos(phi) for phi in phis]
+        append = self._steps.append
+        for index in range(len(phis) - 1):
+            a = sin((phis[index + 1] - phis[index]) / 2) ** 2 + cosines[index] * cosines[index + 1] * sin((lambdas[index + 1] - lambdas[index]) / 2) ** 2
+            append(2 * EARTH_RADIUS_M * asin(min(1.0, sqrt(a))))
+        return self._steps
+
+    def stops(self, radius_m=50.0, min_seconds=300):
+        """Stays of at least `min_seconds` within `radius_m` of where they started."""
+        stops = []; times = self.times; lats = self.lats.tolist(); lons = self.lons.tolist()
+        index = 0; count = len(times); cos = math.cos; radians = math.radians
+        # Compared in squared degrees of latitude, with longitude scaled at the anchor point.
+        limit = (radius_m / (EARTH_RADIUS_M * math.pi / 180)) ** 2
+        while index < count:
+            lat0 = lats[index]; lon0 = lons[index]; scale = cos(radians(lat0))
+            end = index + 1
+            while end < count and (lats[end] - lat0) ** 2 + ((lons[end] - lon0) * scale) ** 2 <= limit: end += 1
+            if times[end - 1] - times[index] >= min_seconds:
+                points = end - index
+                stops.append({'start': _iso(times[index]), 'end': _iso(times[end - 1]), 'seconds': times[end - 1] - times[index], 'latitude': round(sum(lats[index:end]) / points, 6), 'longitude': round(sum(lons[index:end]) / points, 6), 'points': points})
+                index = end
+            else:
+                index += 1
+        return stops
+
+    def dwell_times(self, geofence_set, max_gap=7200):
+        """Seconds spent in and visits to each zone. An interval counts towards a zone when both
+        of its ends are inside it and the points are at most `max_gap` seconds apart."""
+        empty = frozenset(); times = self.times
+        matches = [frozenset(zone['name'] for zone in zones) if zones else empty for zones in geofence_set.matches_many(zip(self.lats.tolist(), self.lons.tolist()))]
+        matches.append(empty)
+        dwell = {}; previous = empty
+        for index in range(len(matches) - 1):
+            names = matches[index]
+            if not names: previous = empty; continue
+            for name in names - previous: dwell.setdefault(name, {'seconds': 0, 'visits': 0})['visits'] += 1
+            following = matches[index + 1]
+            if following and times[index + 1] - times[index] <= max_gap:
+                for name in names & following: dwell[name]['seconds'] += times[index + 1] - times[index]
+            previous = names
+        return dwell
+
+    def summary(self, geofence_set=None, stop_radius_m=50.0, stop_seconds=300, max_gap=7200):
+        count = len(self.times)
+        if not count: return {'points': 0, 'start': None, 'end': None, 'distance_m': 0.0, 'moving_seconds': 0, 'average_speed_mps': 0.0, 'max_speed_mps': 0.0, 'stops': [], 'dwell': {}, 'battery': None, 'truncated': self.truncated}
+        distances = self.step_distances(); times = self.times
+        moving_seconds = 0; moving_distance = 0.0; max_speed = 0.0
+        for index, distance in enumerate(distances):
+            gap = times[index + 1] - times[index]
+            if gap <= 0 or gap > max_gap: continue
+            speed = distance / gap
+            if speed > max_speed: max_speed = speed
+            # Below walking pace is GPS jitter around a stationary device.
+            if speed > 0.5: moving_seconds += gap; moving_distance += distance
+        known = [level for level in self.battery if level != UNKNOWN_BATTERY]
+        return {
+            'points': count,
+            'start': _iso(times[0]), 'end': _iso(times[-1]),
+            'distance_m': round(sum(distances), 1),
+            'moving_seconds': moving_seconds,
+            'average_speed_mps': round(moving_distance / moving_seconds, 2) if moving_seconds else 0.0,
+            'max_speed_mps': round(max_speed, 2),
+            'stops': self.stops(stop_radius_m, stop_seconds),
+            'dwell': self.dwell_times(geofence_set, max_gap) if geofence_set is not None else {},
+            'battery': {'first': known[0], 'last': known[-1], 'min': min(known)} if known else None,
+            'truncated': self.truncated,
+        }
@@ -0,0 +1,68 @@
+import heapq
+import math
+from datetime import datetime
+
+EARTH_RADIUS_M = 6371e3
+
+
+def _epoch(timestamp):
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def _project(points):
+    """Equirectangular projection to metres around the track's mean latitude;
+    accurate enough for measuring how far a point strays from a track segment."""
+    lat0 = math.radians(sum(point['latitude'] for point in points) / len(points))
+    scale = EARTH_RADIUS_M * math.cos(lat0)
+    return [(math.radians(point['longitude']) * scale, math.radians(point['latitude']) * EARTH_RADIUS_M) for point in points]
+
+
+def _segment_distance(p, a, b):
+    dx = b[0] - a[0]; dy = b[1] - a[1]
+    if dx == 0 and dy == 0: return math.hypot(p[0] - a[0], p[1] - a[1])
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def douglas_peucker(points, max_points, tolerance_m=0.0):
+    """Simplifies a time-ordered track to at most `max_points` points.
+
+    Top-down Douglas-Peucker: starting from the two end points, repeatedly
+    keeps the point furthest from its current segment, always splitting the
+    segment with the largest deviation first, until `max_points` are kept or
+    nothing deviates by more than `tolerance_m` metres.
+    """
+    if len(points) <= max_points: return list(points)
+    if max_points < 2: return list(points[:max_points])
+    coords = _project(points)
+    keep = {0, len(points) - 1}
+    heap = []
+
+    def split(first, last):
+        best = -1.0; best_index = None
+        for index in range(first + 1, last):
+            distance = _segment_distance(coords[index], coords[first], coords[last])
+            if distance > best: best = distance; best_index = index
+        if best_index is not None: heapq.heappush(heap, (-best, first, last, best_index))
+
+    split(0, len(points) - 1)
+    while heap and len(keep) < max_points:
+        distance, first, last, index = heapq.heappop(heap)
+        if -distance <= tolerance_m: break
+        keep.add(index)
+        split(first, index); split(index, last)
+    return [points[index] for index in sorted(keep)]
+
+
+def time_bucket_decimate(points, max_points):
+    """Keeps the first point of each of `max_points - 1` equal time buckets, plus the last point."""
+    if len(points) <= max_points: return list(points)
+    if max_points < 2: return list(points[:max_points])
+    start = _epoch(points[0]['timestamp']); end = _epoch(points[-1]['timestamp'])
+    width = (end - start) / (max_points - 1) or 1.0
+    kept = []; last_bucket = None
+    for point in points[:-1]:
+        bucket = min(int((_epoch(point['timestamp']) - start) / width), max_points - 2)
+        if bucket != last_bucket: kept.append(point); last_bucket = bucket
+    kept.append(points[-1])
+    return kept